@@ -0,0 +1,67 @@
+""" Benchmark: decoding a video file with one reader vs ChunkedManagerCV2 with 1, 2, 4... workers.
+
+It writes a temporary MJPG video with noisy frames (so decoding is expensive),
+and measures the frames per second of decoding (and a small processing) of all
+of them. The speedup can't be bigger than the number of cores.
+
+Usage: python benchmarks/chunked_decoding.py [frames]
+"""
+import cv2
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cv2_tools.Management import ChunkedManagerCV2, ManagerCV2
+
+
+def write_video(path, n_frames, shape=(720, 1280)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, shape[::-1])
+    frame = np.random.RandomState(0).randint(0, 256, shape + (3,), dtype=np.uint8)
+    for i in range(n_frames):
+        writer.write(np.roll(frame, i, axis=1))
+    writer.release()
+
+
+def mean_value(frame):
+    return frame.mean()
+
+
+def measure(function):
+    start = time.perf_counter()
+    count = function()
+    return count / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'video.avi')
+        write_video(path, n_frames)
+        # cv2 must not use its own threads, otherwise we measure both at the same time
+        cv2.setNumThreads(1)
+
+        def single_reader():
+            return sum(1 for frame in ManagerCV2(cv2.VideoCapture(path), queue_size=32) if mean_value(frame) >= 0)
+
+        base = measure(single_reader)
+        print('cores: {}'.format(os.cpu_count()))
+        print('{:<24} {:8.1f} FPS'.format('ManagerCV2', base))
+        workers = 1
+        while workers <= max(2, os.cpu_count()):
+            for processes in (False, True):
+                def chunked():
+                    manager = ChunkedManagerCV2(path, chunks=workers)
+                    return sum(1 for _ in manager.map(mean_value, workers=workers, processes=processes))
+
+                fps = measure(chunked)
+                name = '{} {}'.format(workers, 'processes' if processes else 'threads')
+                print('{:<24} {:8.1f} FPS  x{:.2f}'.format(name, fps, fps / base))
+            workers *= 2
+    finally:
+        shutil.rmtree(directory)
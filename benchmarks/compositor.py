@@ -0,0 +1,46 @@
+""" Micro-benchmark: drawing a lot of selected zones with and without the CompositorCV2.
+
+The zones are random filled boxes over a 1920x1080 frame, all of them with
+tags. It measures SelectorCV2.draw blending each primitive directly and with
+composite=True, and prints the number of blends made by the compositor (one
+for each different alpha value).
+
+Usage: python benchmarks/compositor.py [zones]
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cv2_tools.Selection import SelectorCV2
+
+
+def random_selector(n_zones, seed=0, width=1920, height=1080):
+    random = np.random.RandomState(seed)
+    selector = SelectorCV2(filled=True)
+    for i in range(n_zones):
+        x1, y1 = random.randint(0, width - 100), random.randint(0, height - 100)
+        selector.add_zone((x1, y1, x1 + random.randint(20, 100), y1 + random.randint(20, 80)),
+                          tags=['zone {}'.format(i)])
+    return selector
+
+
+def measure(n_zones, composite=False, repeat=20):
+    selector = random_selector(n_zones)
+    frame = np.random.RandomState(1).randint(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    selector.draw(frame, composite=composite, in_place=False)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        selector.draw(frame, composite=composite, in_place=False)
+    return (time.perf_counter() - start) / repeat * 1e3, selector.compositor.blends
+
+
+if __name__ == '__main__':
+    zones = [int(sys.argv[1])] if len(sys.argv) > 1 else [10, 50, 200]
+    for n_zones in zones:
+        direct = min(measure(n_zones)[0] for _ in range(5))
+        composite, blends = min(measure(n_zones, composite=True) for _ in range(5))
+        print('{:4} zones: direct {:8.3f} ms/frame, composite {:8.3f} ms/frame ({} blends)'.format(
+            n_zones, direct, composite, blends))
@@ -0,0 +1,51 @@
+""" Micro-benchmark: overhead of handing frames from the ManagerCV2 reader thread to the consumer.
+
+The video is a fake one that returns the same small frame instantly, so
+almost all the measured time is spent moving frames between threads.
+
+Usage: python benchmarks/frame_handoff.py [frames]
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cv2_tools.Management import ManagerCV2
+
+
+class InstantVideo():
+    """ Fake cv2.VideoCapture that returns a constant frame"""
+
+    def __init__(self, n_frames, shape=(8, 8, 3)):
+        self.remaining = n_frames
+        self.frame = np.zeros(shape, dtype=np.uint8)
+
+    def read(self, image=None):
+        if self.remaining <= 0:
+            return False, None
+        self.remaining -= 1
+        return True, self.frame
+
+    def get(self, prop_id):
+        return 0
+
+    def release(self):
+        pass
+
+
+def measure(n_frames, **kwargs):
+    manager = ManagerCV2(InstantVideo(n_frames), **kwargs)
+    start = time.perf_counter()
+    for _ in manager:
+        pass
+    elapsed = time.perf_counter() - start
+    return elapsed / manager.count_frames * 1e6, manager.count_frames
+
+
+if __name__ == '__main__':
+    n_frames = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    for name, kwargs in (('queue_size=256', {}), ('queue_size=2', {'queue_size': 2})):
+        best = min(measure(n_frames, **kwargs)[0] for _ in range(3))
+        print('{:<16} {:8.2f} us/frame'.format(name, best))
@@ -0,0 +1,43 @@
+""" Micro-benchmark: time to choose the side of the tags of a lot of selected zones.
+
+The zones are random boxes over a 1920x1080 frame, all of them with tags. It
+measures a full placement and, with a TagsLayoutMemory, the following frames
+where the zones move a few pixels or don't move at all.
+
+Usage: python benchmarks/tags_layout.py [zones]
+"""
+import numpy as np
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cv2_tools.tags_constraint import TagsLayoutMemory, get_possible_positions
+
+
+def random_zones(n_zones, seed=0, width=1920, height=1080):
+    random = np.random.RandomState(seed)
+    x1, y1 = random.randint(0, width - 100, n_zones), random.randint(0, height - 100, n_zones)
+    return np.stack([x1, y1, x1 + random.randint(20, 100, n_zones), y1 + random.randint(20, 100, n_zones)], axis=1)
+
+
+def measure(n_zones, memory=False, moving=True, repeat=200):
+    zones = random_zones(n_zones)
+    shapes = [(70, 40)] * n_zones
+    layout_memory = TagsLayoutMemory() if memory else None
+    random = np.random.RandomState(1)
+    moves = random.randint(-2, 3, (repeat, n_zones, 1)) * np.array([1, 0, 1, 0]) * moving
+    get_possible_positions(1920, 1080, zones, shapes, memory=layout_memory)
+    start = time.perf_counter()
+    for move in moves:
+        get_possible_positions(1920, 1080, zones + move if memory else zones, shapes, memory=layout_memory)
+    return (time.perf_counter() - start) / repeat * 1e3
+
+
+if __name__ == '__main__':
+    n_zones = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    for name, memory, moving in (('full layout', False, False), ('with memory', True, True),
+                                 ('static scene', True, False)):
+        best = min(measure(n_zones, memory=memory, moving=moving) for _ in range(3))
+        print('{:<16} {:8.3f} ms/frame ({} zones)'.format(name, best, n_zones))
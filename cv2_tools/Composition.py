@@ -0,0 +1,143 @@
+# MIT License
+# Copyright (c) 2019 Fernando Perez
+import numpy as np
+import cv2
+
+from cv2_tools.Utils import draw_primitives, get_primitives_region
+
+
+class CompositorCV2():
+    """ CompositorCV2 helps to draw a lot of transparent elements at once.
+
+    Instead of blending each primitive (rectangles, lines, tags backgrounds...)
+    with the frame as soon as it is added, the compositor collects them and
+    blends them when you call `compose`.
+
+    Primitives are grouped by their alpha value, and each alpha group is
+    blended with the frame only once: all its primitives are drawn (in the
+    order they were added) into a single overlay layer, which is blended with
+    the region of the frame that contains all of them. If the primitives of a
+    group are far from each other, only their regions are packed together and
+    blended, instead of the whole region. So the number of blends is the number
+    of different alpha values, not the number of zones and effects. Texts are
+    not transparent, they are drawn at the end, over everything else.
+
+    Have in mind that primitives with the same alpha are blended only once
+    even if they overlap, and if two primitives with a different alpha overlap,
+    both are blended, in the order their alpha values were added for the first
+    time.
+    """
+
+
+    def __init__(self):
+        """  CompositorCV2 constructor."""
+        # {alpha: [regions, primitives]} (in order of appearance), with the region (x1, y1, x2, y2)
+        # of the primitives of each call to add_primitives (they are not clipped to the frame)
+        self.groups = {}
+        self.texts = []
+        # Number of blends of the last call to compose (one for each alpha group)
+        self.blends = 0
+        # Overlay layer with the size of the frame, kept between frames
+        self.__layer = None
+
+
+    def add_primitives(self, primitives, alpha):
+        """ Add primitives with the given alpha.
+
+        Arguments:
+        primitives -- list of primitives (check Utils.draw_primitives)
+        alpha -- transparency of the primitives on the image
+                 1 means totally visible and 0 totally invisible
+        """
+        region = get_primitives_region(None, primitives)
+        if region is None:
+            return
+
+        regions, group_primitives = self.groups.setdefault(alpha, ([], []))
+        if not regions or not self.__contains(regions[-1], region):
+            regions.append(region)
+        group_primitives.extend(primitives)
+
+
+    def add_text(self, text, origin, font_info):
+        """ Add a text.
+
+        Arguments:
+        text -- string to write
+        origin -- touple (x, y) with the bottom-left corner of the text
+        font_info -- touple with 4 elements (font, font_scale, font_color, thickness)
+        """
+        self.texts.append((text, origin, font_info))
+
+
+    def clear(self):
+        """ Remove all the collected primitives and texts."""
+        self.groups = {}
+        self.texts = []
+
+
+    def compose(self, frame):
+        """ Draw everything collected on the frame and clear the compositor.
+
+        Arguments:
+        frame -- opencv frame object where you want to draw
+
+        Return:
+        The same frame, drawed
+        """
+        self.blends = 0
+        if self.__layer is None or self.__layer.shape != frame.shape or self.__layer.dtype != frame.dtype:
+            self.__layer = np.zeros_like(frame)
+
+        f_height, f_width = frame.shape[:2]
+        for alpha, (regions, primitives) in self.groups.items():
+            regions = np.array(regions)
+            np.clip(regions, 0, (f_width, f_height, f_width, f_height), out=regions)
+            areas = np.maximum(regions[:, 2] - regions[:, 0], 0) * np.maximum(regions[:, 3] - regions[:, 1], 0)
+            if areas.any():
+                self.__blend_group(frame, regions[areas > 0], int(areas.sum()), primitives, alpha)
+
+        for text, origin, (font, font_scale, font_color, thickness) in self.texts:
+            cv2.putText(frame, text, origin, font, font_scale, font_color, thickness)
+
+        self.clear()
+        return frame
+
+
+    def __blend_group(self, frame, regions, area, primitives, alpha):
+        """ Internal method to blend an alpha group with the frame (only once)"""
+        layer = self.__layer
+        # Region of the frame with all the primitives of the group
+        (x1, y1), (x2, y2) = regions[:, :2].min(axis=0), regions[:, 2:].max(axis=0)
+        self.blends += 1
+
+        # Not covered pixels are a copy of the frame, and they are not modified by addWeighted,
+        # so we don't need any mask
+        if area * 4 >= (x2 - x1) * (y2 - y1):
+            roi = frame[y1:y2, x1:x2]
+            layer[y1:y2, x1:x2] = roi
+            draw_primitives(layer, primitives)
+            roi[:] = cv2.addWeighted(layer[y1:y2, x1:x2], alpha, roi, 1 - alpha, 0)
+            return
+
+        # Sparse primitives (far from each other): only the regions of each call to add_primitives are
+        # packed together and blended, instead of the whole region of the group
+        regions = [(slice(r_y1, r_y2), slice(r_x1, r_x2)) for r_x1, r_y1, r_x2, r_y2 in regions.tolist()]
+        for region in regions:
+            layer[region] = frame[region]
+        draw_primitives(layer, primitives)
+        blended = cv2.addWeighted(np.concatenate([layer[region].reshape(-1) for region in regions]), alpha,
+                                  np.concatenate([frame[region].reshape(-1) for region in regions]), 1 - alpha, 0)
+        # A pixel repeated in more than one region gets the same value each time
+        start = 0
+        for region in regions:
+            roi = frame[region]
+            roi[:] = blended[start:start + roi.size].reshape(roi.shape)
+            start += roi.size
+
+
+    @staticmethod
+    def __contains(region1, region2):
+        """ Internal method to check if region1 contains region2"""
+        return (region1[0] <= region2[0] and region1[1] <= region2[1]
+                and region2[2] <= region1[2] and region2[3] <= region1[3])
@@ -1,29 +1,122 @@
 # MIT License
 # Copyright (c) 2019 Fernando Perez
 import numpy as np
+import asyncio
+import bisect
+import importlib
+import os
 import time
 import cv2
 
-try:
-    from PIL import Image
-except ModuleNotFoundError as e:
-    pass
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+from threading import Condition, Lock, Thread, current_thread, main_thread
 
-try:
-    # It is usefull if you want to detect scene changes
-    import imagehash
-except ModuleNotFoundError as e:
-    pass
 
-try:
-    # It is usefull if you want to track objects
-    import dlib
-except ModuleNotFoundError as e:
-    pass
+def load_backend(module, feature, package=None):
+    """ Import an optional backend the first time it is needed.
 
+    Arguments:
+    module -- name of the module to import
+    feature -- what the module is needed for (only for the error message)
 
-from queue import Queue
-from threading import Thread
+    Keyword arguments:
+    package -- name of the package to install if it is not found (default module)
+
+    Return:
+    The imported module
+    """
+    try:
+        return importlib.import_module(module)
+    except ModuleNotFoundError as e:
+        raise ModuleNotFoundError('{} is needed {}, you can install it with: pip install {}'.format(
+            module, feature, package or module)) from e
+
+
+# Shared memory of the frames attached by each process of `ManagerCV2.map` (by its name)
+_attached_frames = {}
+
+
+def get_frame_hash(frame):
+    """ Get the difference hash (dhash) of a frame, two frames of the same scene have similar hashes
+
+    The frame is reduced to 9x8 pixels (in gray) and each bit of the hash
+    indicates if a pixel is brighter than the previous one (in the same row).
+    Only a grid of 72x64 pixels of the frame is used, so it is very fast
+    even with big frames.
+
+    Arguments:
+    frame -- opencv frame object (BGR, BGRA or gray)
+
+    Return:
+    The hash, as an integer of 64 bits
+    """
+    small = cv2.resize(frame, (72, 64), interpolation=cv2.INTER_NEAREST)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGRA2GRAY if small.shape[2] == 4 else cv2.COLOR_BGR2GRAY)
+    pixels = cv2.resize(small, (9, 8), interpolation=cv2.INTER_AREA)
+    return int(np.packbits(pixels[:, 1:] > pixels[:, :-1]).view('>u8')[0])
+
+
+def get_hash_distance(hash1, hash2):
+    """ Get the number of different bits (from 0 to 64) between two hashes of `get_frame_hash`"""
+    return bin(hash1 ^ hash2).count('1')
+
+
+def read_chunk(path, start=0, stop=None):
+    """ Read a range of frames of a video file
+
+    Arguments:
+    path -- path of the video file
+
+    Keyword arguments:
+    start -- index of the first frame (Default: 0)
+    stop -- index of the frame after the last one, None means until the end (Default: None)
+
+    Return:
+    Generator of touples (index, timestamp, frame), timestamp is the position
+    of the frame in seconds inside the video
+    """
+    video = cv2.VideoCapture(path)
+    try:
+        if start:
+            video.set(cv2.CAP_PROP_POS_FRAMES, start)
+        index = start
+        while stop is None or index < stop:
+            ret, frame = video.read()
+            if not ret:
+                break
+            yield index, video.get(cv2.CAP_PROP_POS_MSEC) / 1000, frame
+            index += 1
+    finally:
+        video.release()
+
+
+def _process_chunk(path, start, stop, func, args, kwargs):
+    """ Internal method to execute func with each frame of a chunk (inside a thread or process of the pool)"""
+    return [(index, timestamp, func(frame, *args, **kwargs)) for index, timestamp, frame in read_chunk(path, start, stop)]
+
+
+def _process_chunk_frames(path, start, stop, func, args, kwargs):
+    """ Internal method to execute func with all the frames of a chunk (inside a thread or process of the pool)"""
+    return func(read_chunk(path, start, stop), *args, **kwargs)
+
+
+def _wake_waiter(waiter):
+    """ Internal method to wake up a coroutine waiting for a FrameRing (inside its event loop)"""
+    if not waiter.done():
+        waiter.set_result(None)
+
+
+def _process_shared_frame(name, shape, dtype, slot, func, args, kwargs):
+    """ Internal method to execute func with a frame of the shared memory (inside a process of the pool)"""
+    if name not in _attached_frames:
+        # Only the last memory is kept, the previous ones were already destroyed by the main process
+        _attached_frames.clear()
+        memory = shared_memory.SharedMemory(name=name)
+        _attached_frames[name] = (memory, np.ndarray(shape, dtype=dtype, buffer=memory.buf))
+    return func(_attached_frames[name][1][slot], *args, **kwargs)
 
 
 class ManagerCV2():
@@ -40,6 +133,16 @@ class ManagerCV2():
 
 
     _tries_reconnect_stream = 10
+    # With an adaptive scene threshold: number of frames to learn the usual distance between
+    # frames, and how many standard deviations over it a distance means a new scene
+    _scene_warmup_frames = 10
+    _scene_deviations = 4
+    # Threshold while it is learning
+    _scene_warmup_threshold = 25
+    # To skip more frames than this, it seeks (with videos) instead of grabbing them
+    _seek_frames = 50
+    # With adaptive_queue, seconds of frames (at the rate of the consumer) to keep in the queue
+    _adaptive_queue_seconds = 1
 
     class KeystrokeManager():
         """ KeystrokeManager helps to manage all keystroke during the for of the manager
@@ -89,7 +192,344 @@ class ManagerCV2():
                 setattr(self, arg, not value)
 
 
-    def __init__(self, video, is_stream=False, fps_limit=0, queue_size=256, detect_scenes=False, show_video=False):
+    class FramePool():
+        """ FramePool keeps the buffers of the frames that were already consumed
+
+        With this Class ManagerCV2 is capable to decode each new frame inside
+        the buffer of an old one (with `video.read(image=buffer)`), so once the
+        pool is warm there are no new allocations for each frame.
+        """
+
+        def __init__(self, max_free):
+            """ FramePool constructor.
+
+            Arguments:
+            max_free -- maximum number of free buffers to keep, the rest are
+                        left to the garbage collector
+            """
+            self.max_free = max_free
+            self.allocations = 0
+            self.reuses = 0
+            self.__free = []
+            self.__lock = Lock()
+
+        def get(self):
+            """ get
+
+            Get a free buffer to decode a frame on it, None if there is no one
+            (so the video will allocate a new one).
+            """
+            with self.__lock:
+                if self.__free:
+                    self.reuses += 1
+                    return self.__free.pop()
+                self.allocations += 1
+                return None
+
+        def put(self, buffer):
+            """ put
+
+            Give back a buffer that nobody is using.
+            """
+            with self.__lock:
+                if buffer is not None and len(self.__free) < self.max_free:
+                    self.__free.append(buffer)
+
+        def clear(self):
+            """ clear
+
+            Forget all the free buffers.
+            """
+            with self.__lock:
+                self.__free = []
+
+
+    class FrameRing():
+        """ FrameRing is the queue between the reader thread and the consumer
+
+        It is a ring of frames protected by a single condition variable: the
+        reader waits while it is full and the consumer waits while it is empty,
+        and each one only wakes up the other one when it is really waiting.
+        Once it is closed, nobody waits anymore: put does nothing and get
+        returns the remaining frames and then None.
+        A consumer inside an asyncio event loop waits with `get_async` instead,
+        and the reader wakes it up through its event loop.
+        """
+
+        # Seconds between checks (while waiting) that the main thread is still alive
+        _check_interval = 0.1
+
+        def __init__(self, depth):
+            """ FrameRing constructor.
+
+            Arguments:
+            depth -- maximum number of frames in the ring
+            """
+            self.depth = depth
+            self.closed = False
+            self.__items = deque()
+            self.__condition = Condition(Lock())
+            self.__waiting_put = False
+            self.__waiting_get = False
+            # Touples (loop, future) of the coroutines waiting in get_async
+            self.__async_waiters = []
+
+        def __len__(self):
+            return len(self.__items)
+
+        def put(self, item, drop_oldest=False):
+            """ put
+
+            Add an item. If the ring is full, it waits until there is space, or
+            if drop_oldest, it removes the oldest items instead.
+
+            Return:
+            List with the dropped items, None if the ring was closed
+            """
+            with self.__condition:
+                dropped = []
+                if drop_oldest:
+                    while len(self.__items) >= self.depth:
+                        dropped.append(self.__items.popleft())
+                else:
+                    while len(self.__items) >= self.depth and not self.closed:
+                        # The reader is not a daemon thread, so it can't wait forever if the program finished
+                        if not main_thread().is_alive():
+                            self.closed = True
+                            break
+                        self.__waiting_put = True
+                        self.__condition.wait(ManagerCV2.FrameRing._check_interval)
+                    self.__waiting_put = False
+                if self.closed:
+                    return None
+                self.__items.append(item)
+                if self.__waiting_get:
+                    self.__condition.notify()
+                if self.__async_waiters:
+                    self.__wake_async_waiters()
+                return dropped
+
+        def get(self):
+            """ get
+
+            Get the oldest item, waiting until there is one.
+
+            Return:
+            The item, None if the ring is closed and empty
+            """
+            with self.__condition:
+                while not self.__items:
+                    if self.closed:
+                        return None
+                    self.__waiting_get = True
+                    self.__condition.wait()
+                self.__waiting_get = False
+                item = self.__items.popleft()
+                if self.__waiting_put:
+                    self.__condition.notify()
+                return item
+
+        async def get_async(self, timeout=None):
+            """ get_async
+
+            Get the oldest item, waiting (without blocking the event loop) until there is one.
+
+            Keyword arguments:
+            timeout -- Maximum seconds to wait, None means forever. If there is no item
+                       before, it raises asyncio.TimeoutError (Default: None)
+
+            Return:
+            The item, None if the ring is closed and empty
+            """
+            loop = asyncio.get_running_loop()
+            deadline = None if timeout is None else loop.time() + timeout
+            while True:
+                with self.__condition:
+                    if self.__items:
+                        item = self.__items.popleft()
+                        if self.__waiting_put:
+                            self.__condition.notify()
+                        return item
+                    if self.closed:
+                        return None
+                    waiter = loop.create_future()
+                    self.__async_waiters.append((loop, waiter))
+                try:
+                    if deadline is None:
+                        await waiter
+                    else:
+                        await asyncio.wait_for(waiter, max(0, deadline - loop.time()))
+                finally:
+                    with self.__condition:
+                        if (loop, waiter) in self.__async_waiters:
+                            self.__async_waiters.remove((loop, waiter))
+
+        def __wake_async_waiters(self):
+            """ Internal method to wake up all the coroutines waiting in get_async (with the lock)"""
+            for loop, waiter in self.__async_waiters:
+                try:
+                    loop.call_soon_threadsafe(_wake_waiter, waiter)
+                except RuntimeError:
+                    # Its event loop is already closed
+                    pass
+            self.__async_waiters = []
+
+        def set_depth(self, depth):
+            """ set_depth
+
+            Change the maximum number of frames in the ring.
+            """
+            with self.__condition:
+                self.depth = depth
+                self.__condition.notify_all()
+
+        def close(self):
+            """ close
+
+            Nobody waits anymore, it wakes up everybody.
+            """
+            with self.__condition:
+                self.closed = True
+                self.__condition.notify_all()
+                self.__wake_async_waiters()
+
+
+    class SharedFrames():
+        """ SharedFrames is a ring of frames in shared memory
+
+        With this Class ManagerCV2 is capable to decode each frame directly inside
+        a slot of a shared memory block, so the processes of `map` only need the
+        index of the slot to get the frame, there are no copies (or pickles) of the
+        frames between processes. The memory is created with the size of the first
+        frame, all the frames must have the same size.
+        """
+
+        def __init__(self, slots):
+            """ SharedFrames constructor.
+
+            Arguments:
+            slots -- number of frames in the shared memory, the reader waits
+                     until there is a free one to decode the next frame
+            """
+            self.slots = slots
+            self.memory = None
+            self.frames = None
+            self.closed = False
+            self.__free = deque(range(slots))
+            self.__condition = Condition(Lock())
+
+        def read(self, video):
+            """ read
+
+            Decode the next frame of the video inside a free slot, waiting until there is one.
+
+            Return:
+            Touple (ret, frame) as video.read()
+            """
+            slot = self.get()
+            if slot is None:
+                return False, None
+            if self.memory is None:
+                ret, frame = video.read()
+                if ret:
+                    self.allocate(frame)
+                    self.frames[slot] = frame
+                    frame = self.frames[slot]
+            else:
+                ret, frame = video.read(self.frames[slot])
+            if not ret or self.get_slot(frame) != slot:
+                # A frame with a different size can't be stored in the shared memory
+                self.put(None, slot=slot)
+                return False, None
+            return True, frame
+
+        def allocate(self, frame):
+            """ allocate
+
+            Create the shared memory with the size of the frame.
+            """
+            self.memory = shared_memory.SharedMemory(create=True, size=self.slots * frame.nbytes)
+            self.frames = np.ndarray((self.slots,) + frame.shape, dtype=frame.dtype, buffer=self.memory.buf)
+
+        def get(self):
+            """ get
+
+            Get the index of a free slot, waiting until there is one.
+            None if it is closed.
+            """
+            with self.__condition:
+                while not self.__free and not self.closed:
+                    # The reader is not a daemon thread, so it can't wait forever if the program finished
+                    if not main_thread().is_alive():
+                        self.closed = True
+                        break
+                    self.__condition.wait(ManagerCV2.FrameRing._check_interval)
+                if self.closed:
+                    return None
+                return self.__free.popleft()
+
+        def put(self, frame, slot=None):
+            """ put
+
+            Give back a frame (or its slot) that nobody is using.
+            """
+            if slot is None:
+                slot = self.get_slot(frame)
+                if slot is None:
+                    return
+            with self.__condition:
+                if slot not in self.__free:
+                    self.__free.append(slot)
+                    self.__condition.notify()
+
+        def get_slot(self, frame):
+            """ get_slot
+
+            Get the index of the slot of a frame, None if it is not in the shared memory.
+            """
+            if frame is None or self.frames is None:
+                return None
+            offset = frame.__array_interface__['data'][0] - self.frames.__array_interface__['data'][0]
+            slot, rest = divmod(offset, self.frames[0].nbytes)
+            if rest or not 0 <= slot < self.slots:
+                return None
+            return slot
+
+        def get_info(self):
+            """ get_info
+
+            Get what a process needs to attach the shared memory: touple (name, shape, dtype)
+            """
+            return self.memory.name, self.frames.shape, self.frames.dtype.str
+
+        def close(self):
+            """ close
+
+            Nobody waits anymore, it wakes up everybody.
+            """
+            with self.__condition:
+                self.closed = True
+                self.__condition.notify_all()
+
+        def release(self):
+            """ release
+
+            Close and destroy the shared memory. Frames of the shared memory that
+            are still in use keep their memory mapped until they are garbage collected.
+            """
+            self.close()
+            self.frames = None
+            if self.memory is not None:
+                try:
+                    self.memory.close()
+                except BufferError:
+                    pass
+                self.memory.unlink()
+
+
+    def __init__(self, video, is_stream=False, fps_limit=0, queue_size=256, detect_scenes=False, scene_threshold=25, show_video=False,
+                 reuse_frames=False, queue_bytes=None, adaptive_queue=False, latest_frame=False, frame_timeout=None,
+                 stride=1, target_fps=None):
         """  ManagerCV2 constructor.
 
         Arguments:
@@ -105,13 +545,42 @@ class ManagerCV2():
         fps_limit -- You can set with it the maximum FPS of the video. If you
                      set it to 0, it means no limit. (Default: 0)
         queue_size -- The maximum number of frames to store in the queue (for multiprocessing). (Default: 256)
-        detect_scenes -- Bool to indicate if you want to detect changes of scenes,
-                         it will have an small impact on the frame rate. Almost 0
-                         if it is a video and you set fps_limit < 60. (Default: False)
+        detect_scenes -- Bool to indicate if you want to detect changes of scenes. The reader
+                         thread compares the hash of each frame with the previous one (check
+                         `get_frame_hash`), it takes less than 0.1 ms for each frame. Then check
+                         `new_scene` and `scene_score` (distance from 0 to 64). (Default: False)
+        scene_threshold -- Minimum distance between the hashes of two frames to consider it a new
+                           scene. If None, it adapts to the usual distance of the video (useful with
+                           noisy cameras). (Default: 25)
         show_video -- Bool to indicate if you want to show the video (with cv2.imshow).
                       If you use the method `add_keystroke` you don't need to use this param
                       (its fine if you still want to put it to True).
                       Also, if you doesn't want to show the video, let it a False. (Default: False)
+        reuse_frames -- Bool to indicate if the buffer of each frame can be reused to decode
+                        a new one once you ask for the next frame, so there are no allocations
+                        for each frame. If you need to keep a frame for longer, call `lease_frame`
+                        and `return_frame` when you don't need it anymore. (Default: False)
+        queue_bytes -- The maximum number of bytes of the frames stored in the queue. The number
+                       of frames is calculated with the size of the first frame (and it is never
+                       bigger than queue_size). For example 512*2**20 are 512 MB. (Default: None)
+        adaptive_queue -- Bool to indicate if the number of frames in the queue should adapt to
+                          the rate of the consumer. If the consumer is slow, it is useless to decode
+                          a lot of frames before it asks for them, so the queue keeps only the frames
+                          that the consumer needs during `ManagerCV2._adaptive_queue_seconds`
+                          (never more than queue_size or queue_bytes allow). (Default: False)
+        latest_frame -- Bool to indicate if you always want the newest frame (usefull for streams
+                        when your code is slower than the camera). The queue keeps only one frame,
+                        each new frame replaces the previous one if it wasn't consumed yet, so you
+                        never process old frames. Check `dropped_frames` and `get_latency`. (Default: False)
+        frame_timeout -- Maximum seconds to wait for each frame with `async for`. If there is no
+                         frame before, it raises asyncio.TimeoutError (the manager keeps reading,
+                         so you can continue or call `astop`). None means forever. (Default: None)
+        stride -- Only one of each `stride` frames is returned, the rest are skipped with
+                  `video.grab()`, so they are not decoded. Check `get_frame_info` to know
+                  the index of each frame inside the video. (Default: 1)
+        target_fps -- Same as stride, but calculated with the FPS of the video, for example
+                      with a video of 30 FPS and target_fps=10, one of each 3 frames. It is not
+                      a limit of speed (check fps_limit). None means all of them. (Default: None)
         """
         # Video/Stream managment attributes
         self.video = video
@@ -120,22 +589,45 @@ class ManagerCV2():
         self.fps_limit = fps_limit
         self.show_video = show_video
         self.queue_size = queue_size
+        self.queue_bytes = queue_bytes
+        self.adaptive_queue = adaptive_queue
+        # Current maximum number of frames in the queue (it depends on the frames size)
+        self.queue_depth = queue_size
+        self.max_queue_depth = queue_size
+        self.frame_bytes = 0
+        self.consumer_fps = 0
+        self.latest_frame = latest_frame
+        self.frame_timeout = frame_timeout
+        self.stride = max(1, stride)
+        self.target_fps = target_fps
+        # Frames of the video for each returned frame (it could be a fraction with target_fps)
+        self.frame_step = self.stride
+        # Index of the first frame to read, and if not None, indexes of the only frames to read
+        # (check `seek_scene` and `set_keyframes`)
+        self.start_frame = 0
+        self.keyframes = None
+        self.keyframe = 0
         self.stream_error = False
         self.stopped = False
         self.queue = None
         self.queue_thread = None
-        self.awake_thread = None
+        # Exception raised while reading, it is raised again to the consumer after the queued frames
+        self.reader_error = None
+
+        # Buffers of consumed frames (if reuse_frames)
+        self.reuse_frames = reuse_frames
+        self.frame_pool = ManagerCV2.FramePool(max_free=queue_size + 2)
+        self.current_frame = None
+        # Frames in shared memory (only while `map` uses processes)
+        self.shared_frames = None
 
         # Keystrokes attributes
         self.key_manager = ManagerCV2.KeystrokeManager()
         self.last_keystroke = -1
-        self.__keystroke_dict = {
-            # The first three elements will have allways the same length
-            'keystroke':[],
-            'wait_key':[],
-            'keystroke_args':[],
-            'exit_keystrokes':[],
-        }
+        # {keystroke: (keystroke_args, exit)}
+        self.__keystrokes = {}
+        # Ms to wait keystrokes in each frame (as cv2.waitKey), None if there are no keystrokes
+        self.__wait_key = None
 
         self.ret_handler = None
         self.ret_handler_args = ()
@@ -145,167 +637,706 @@ class ManagerCV2():
         self.initial_time = None
         self.final_time = None
         self.count_frames = 0
+        # Index (inside the video) of the next frame to read
+        self.video_index = 0
+        # Index of the next frame to return (it could be a fraction with target_fps)
+        self.next_index = 0
+        # Index and timestamp of the current frame (check `get_frame_info`)
+        self.current_index = -1
+        self.current_timestamp = None
+        # Frames replaced before being consumed (with latest_frame)
+        self.dropped_frames = 0
+        # Seconds since the current frame was read until it was consumed
+        self.last_latency = 0
+        self.total_latency = 0
 
         # Scene detection
         self.detect_scenes = detect_scenes
         self.new_scene = False
+        self.scene_score = 0
+        # Hash of the current frame (check `get_frame_hash`)
+        self.frame_hash = None
         self.previous_frame_hash = None
-        self.hash_distance = 25
+        self.hash_distance = scene_threshold
+        # Average and variance of the distance between frames of the same scene (adaptive threshold)
+        self.scene_stats = None
 
         # Tracking algorithm
         self.selector_tracker = None
         self.trackers = []
+        self.tracking_scale = 1
+        self.tracking_times = []
+        self.tracking_executor = None
+        self.tracking_workers = 0
 
 
     def __iter__(self):
+        # The reader is still running (e.g. `async for` again after a TimeoutError), so it continues
+        if self.queue_thread is not None and self.queue_thread.is_alive():
+            if not self.stopped:
+                return self
+            self.queue_thread.join()
+
         self.initial_time = time.time()
         self.last_frame_time = self.initial_time
         self.final_time = self.initial_time
         self.count_frames = 0
+        self.video_index = 0
+        if self.start_frame:
+            self.video.set(cv2.CAP_PROP_POS_FRAMES, self.start_frame)
+            self.video_index = self.start_frame
+        self.next_index = self.video_index
+        if self.keyframes is not None:
+            self.keyframe = bisect.bisect_left(self.keyframes, self.video_index)
+            self.next_index = self.keyframes[self.keyframe] if self.keyframe < len(self.keyframes) else None
+        self.new_scene = False
+        self.scene_score = 0
+        self.previous_frame_hash = None
+        self.scene_stats = None
+        self.current_index = -1
+        self.current_timestamp = None
+        self.frame_step = self.stride
+        if self.target_fps:
+            video_fps = self.video.get(cv2.CAP_PROP_FPS)
+            if video_fps > self.target_fps:
+                self.frame_step = max(self.frame_step, video_fps / self.target_fps)
         self.last_keystroke = -1
+        self.dropped_frames = 0
+        self.last_latency = 0
+        self.total_latency = 0
 
         # All queue management
         self.stopped = False
-        self.queue = Queue(maxsize=self.queue_size)
-        self.queue_awake = Queue(maxsize=1)
-
+        self.reader_error = None
+        self.current_frame = None
+        self.queue_depth = self.max_queue_depth = 1 if self.latest_frame else self.queue_size
+        self.frame_bytes = 0
+        self.consumer_fps = 0
+        self.last_get_time = None
+        self.queue = ManagerCV2.FrameRing(self.queue_depth)
+
+        # It is not a daemon, so end_iteration can stop it cleanly
         self.queue_thread = Thread(target=self.fill_queue, args=())
-        self.queue_thread.daemon = True
         self.queue_thread.start()
         return self
 
 
     def __next__(self):
-        # Get frame from queue if not stopped yet
-        if self.stopped and self.queue.qsize() == 0:
+        item = self.get_item()
+        if item is None:
+            self.end_iteration()
+        if not self.consume_item(item):
             self.end_iteration()
+        return item[0]
 
-        frame, frame_hash = self.queue.get(block=True)
 
-        # This is how it comunicates with the thread (to indicate it takes something)
-        if not self.queue_awake.full():
-            self.queue_awake.put(None)
+    def __aiter__(self):
+        """ Iterate the frames with `async for`
 
-        # If we get a frame but it is None, it means that we finished the queue
-        if frame is None:
-            self.end_iteration()
+        Frames are read by the same reader thread, but while there is no frame
+        the event loop is free, so a lot of managers can share it. Have in mind
+        that keystrokes (cv2.waitKey) still block the event loop while they wait.
+        If the task is cancelled the manager stops reading, call `astop` to
+        release the video (it is released at the end of the iteration).
+        After a TimeoutError (frame_timeout) you can `async for` again, it
+        continues with the next frame.
+        """
+        return iter(self)
+
+
+    async def __anext__(self):
+        self.recycle_frame(self.current_frame)
+        self.current_frame = None
+
+        try:
+            item = await self.queue.get_async(self.frame_timeout)
+        except asyncio.CancelledError:
+            self.stop_queue()
+            raise
+        if item is None:
+            self.finish_iteration()
+            if self.reader_error is not None:
+                raise self.reader_error
+            raise StopAsyncIteration
+        if self.adaptive_queue:
+            self.update_queue_depth()
+
+        if not self.consume_item(item, limit_fps=False):
+            self.finish_iteration()
+            raise StopAsyncIteration
+        if self.fps_limit:
+            time_to_sleep = self.get_time_to_sleep()
+            if time_to_sleep > 0:
+                await asyncio.sleep(time_to_sleep)
+            self.last_frame_time = time.time()
+        return item[0]
 
-        # If we must detect scenes it will help us
-        if self.detect_scenes:
-            if not self.previous_frame_hash:
-                self.new_scene = True
-            else:
-                self.new_scene = (frame_hash - self.previous_frame_hash > self.hash_distance)
 
-            self.previous_frame_hash = frame_hash
+    def get_item(self):
+        """ Internal method to get the next item (frame, scene, read_time, index, timestamp) of the queue
 
-        self.final_time = time.time()
-        self.count_frames += 1
+        Return:
+        The item, None if we finished the queue
+        """
+        # The previous frame was already consumed, so its buffer can be reused (if it wasn't leased)
+        self.recycle_frame(self.current_frame)
+        self.current_frame = None
 
-        # If they press one of the keystrokes, it will raise the method
-        for i, wait_key in enumerate(self.__keystroke_dict['wait_key']):
-            self.last_keystroke = cv2.waitKey(wait_key)
+        item = self.queue.get()
+        if item is not None and self.adaptive_queue:
+            self.update_queue_depth()
+        return item
 
-            if self.last_keystroke in self.__keystroke_dict['keystroke']:
-                index = self.__keystroke_dict['keystroke'].index(self.last_keystroke)
 
-                self.key_manager.execute_management(*self.__keystroke_dict['keystroke_args'][index])
-                if self.last_keystroke in self.__keystroke_dict['exit_keystrokes']:
-                    self.end_iteration()
+    def consume_item(self, item, limit_fps=True):
+        """ Internal method to do everything that the consumer does with each frame:
+        scene detection, counters, keystrokes and fps limit (if limit_fps).
+
+        Return:
+        False if the iteration must finish (an exit keystroke was pressed), True eoc
+        """
+        frame, scene, read_time, self.current_index, self.current_timestamp = item
+        self.current_frame = frame
+
+        # The reader thread already detected it
+        if self.detect_scenes:
+            self.scene_score, self.new_scene, self.frame_hash = scene
+
+        self.final_time = time.time()
+        self.count_frames += 1
+        self.last_latency = self.final_time - read_time
+        self.total_latency += self.last_latency
 
         # If we doesn't add a keystroke we should at least wait a minimum in order to
         # be capable to reproduce the video with cv2.imshow (if you indicated that you want
         # tho display the video)
         # Also, you can wait by yourself (without using Management)
-        if self.show_video and not self.__keystroke_dict['wait_key']:
-            cv2.waitKey(1)
+        wait_key = self.__wait_key
+        if wait_key is None and self.show_video:
+            wait_key = 1
+
+        # Only one wait for all the keystrokes. With fps_limit, it waits all the time
+        # until the next frame (instead of sleeping), so no keystroke is lost
+        if wait_key is not None:
+            if wait_key and self.fps_limit and limit_fps:
+                wait_key = max(wait_key, int(self.get_time_to_sleep() * 1000))
+            self.last_keystroke = cv2.waitKey(wait_key)
+
+            # If they press one of the keystrokes, it will raise the method
+            keystroke = self.__keystrokes.get(self.last_keystroke)
+            if keystroke is not None:
+                keystroke_args, exit = keystroke
+                self.key_manager.execute_management(*keystroke_args)
+                if exit:
+                    return False
 
         # Here we limit the speed (if we want constant frames)
-        if self.fps_limit:
-            time_to_sleep = (1 / self.fps_limit) - (time.time() - self.last_frame_time)
+        if self.fps_limit and limit_fps:
+            time_to_sleep = self.get_time_to_sleep()
             if time_to_sleep > 0:
                 time.sleep(time_to_sleep)
 
             self.last_frame_time = time.time()
-        return frame
+        return True
+
+
+    def get_time_to_sleep(self):
+        """ Internal method to get the seconds to wait before the next frame, to respect fps_limit"""
+        return (1 / self.fps_limit) - (time.time() - self.last_frame_time)
+
+
+    def map(self, func, *args, workers=4, window=None, processes=False, **kwargs):
+        """ Process the frames in parallel with a pool of threads (or processes), getting the results in order
+
+        Threads are usefull when func spends most of its time in OpenCV or numpy
+        (they release the GIL), for example detecting objects and drawing them.
+        If func spends most of its time in Python, use processes: the frames are
+        decoded inside a ring of shared memory and each process only gets the
+        index of the frame inside it, so frames are never copied between processes
+        (only the results are sent back). In that case func, args, kwargs and the
+        results must be picklable (func must be defined at the module level), and
+        all the frames must have the same size.
+        Everything else (keystrokes, fps_limit, scene detection, counters...)
+        happens as in a normal iteration, when each result is returned.
+
+        Example:
+        for index, timestamp, result in manager_cv2.map(detect, workers=4):
+            ...
+
+        Arguments:
+        func -- method to execute with each frame: func(frame, *args, **kwargs)
+        args -- Arguments to pass to func (after the frame)
+        kwargs -- Keyword arguments to pass to func
+
+        Keyword arguments:
+        workers -- Number of threads or processes (Default: 4)
+        window -- Maximum number of frames being processed (or waiting for the
+                  previous ones) at the same time. If None, 2*workers (Default: None)
+        processes -- Bool to indicate if you want to use a pool of processes
+                     instead of threads (Default: False)
+
+        Return:
+        Generator of touples (index, timestamp, result), in the same order as the frames.
+        index and timestamp are the same as `get_frame_info` returns
+        """
+        window = window or 2 * workers
+        if processes:
+            if os.name == 'posix':
+                # The processes must share the resource tracker of this process, otherwise
+                # each one would try to destroy the shared memory when it finishes
+                resource_tracker.ensure_running()
+            executor = ProcessPoolExecutor(max_workers=workers)
+            # Start the processes before the reader thread exists
+            executor.submit(int).result()
+            # The reader can decode a few frames while all the window is being processed
+            self.shared_frames = ManagerCV2.SharedFrames(window + workers + 2)
+        else:
+            executor = ThreadPoolExecutor(max_workers=workers)
+        pending = deque()
+        iter(self)
+        try:
+            finished = False
+            while True:
+                # Keep the window full
+                while not finished and len(pending) < window:
+                    item = self.queue.get()
+                    if item is None:
+                        finished = True
+                        break
+                    if processes:
+                        slot = self.shared_frames.get_slot(item[0])
+                        future = executor.submit(_process_shared_frame, *self.shared_frames.get_info(), slot, func, args, kwargs)
+                    else:
+                        future = executor.submit(func, item[0], *args, **kwargs)
+                    pending.append((item, future))
+                if not pending:
+                    break
+
+                item, future = pending.popleft()
+                result = future.result()
+                self.recycle_frame(self.current_frame)
+                if not self.consume_item(item):
+                    break
+                yield item[3], item[4], result
+        finally:
+            for _, future in pending:
+                future.cancel()
+            executor.shutdown(wait=True)
+            self.finish_iteration()
+            if self.shared_frames is not None:
+                # Frames of the shared memory can't be referenced when it is closed
+                pending = item = None
+                self.current_frame = None
+                self.shared_frames.release()
+                self.shared_frames = None
+        if self.reader_error is not None:
+            raise self.reader_error
 
 
     def fill_queue(self):
-        # keep looping infinitely
-        while True:
-            # If the thread indicator variable is set, stop the thread
-            if self.stopped:
-                return
-            if not self.queue.full():
-                ret, frame = self.video.read()
+        try:
+            # keep looping until the end of the video or until the consumer stops it
+            while not self.stopped:
+                if self.next_index is None:
+                    break
+                # With stride, target_fps or keyframes, the frames that we don't need are only grabbed (not decoded)
+                next_index = int(np.ceil(self.next_index - 1e-6))
+                skip = next_index - self.video_index
+                if skip > ManagerCV2._seek_frames and not self.is_stream:
+                    self.video.set(cv2.CAP_PROP_POS_FRAMES, next_index)
+                elif skip > 0 and not all(self.video.grab() for _ in range(skip)):
+                    break
+                self.video_index += max(skip, 0)
+
+                ret, frame = self.read_frame()
                 # In case of streaming it means that we could lose some frames
                 # so this variable is usefull to check it
                 self.stream_error = bool(ret)
 
                 # If it is a streaming we will try to reconnect
                 if self.is_stream and not ret:
-                    exit = False
                     for i in range(ManagerCV2._tries_reconnect_stream):
-                        ret, frame = self.video.read()
+                        ret, frame = self.read_frame()
                         if ret:
                             break
-                        if i+1 == ManagerCV2._tries_reconnect_stream:
-                            self.stop_queue()
-                            return
-                elif not ret:
-                    self.stop_queue()
-                    return
+                if not ret:
+                    break
+
+                if frame.nbytes != self.frame_bytes:
+                    self.set_frame_bytes(frame.nbytes)
+
+                scene = self.detect_scene(frame) if self.detect_scenes else None
+
+                read_time = time.time()
+                timestamp = read_time if self.is_stream else self.video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+
+                # It waits while the queue is full, or with latest_frame, only the newest frame is kept
+                item = (frame,scene,read_time,self.video_index,timestamp)
+                self.video_index += 1
+                self.next_index = self.get_next_index()
+                dropped = self.queue.put(item, drop_oldest=self.latest_frame)
+                if dropped is None:
+                    break
+                for old_frame, *_ in dropped:
+                    self.dropped_frames += 1
+                    self.recycle_frame(old_frame)
+        except Exception as error:
+            # It is raised again to the consumer (after the queued frames)
+            self.reader_error = error
+        finally:
+            self.stop_queue()
 
-                frame_hash = None
-                if self.detect_scenes:
-                    frame_hash = imagehash.dhash(Image.fromarray(frame))
-                self.queue.put((frame,frame_hash))
-                queue_size = self.queue.qsize()
-            else:
-                # I want to wait until someone awake me
-                self.queue_awake.get()
+
+    def get_next_index(self):
+        """ Internal method to get the index of the next frame to return, None if there are no more"""
+        if self.keyframes is None:
+            return self.next_index + self.frame_step
+        self.keyframe += 1
+        return self.keyframes[self.keyframe] if self.keyframe < len(self.keyframes) else None
+
+
+    def seek_scene(self, scene_index, scene):
+        """ Start the iteration at the beginning of a scene (only for video files)
+
+        Call it before iterating. The scenes are taken from an index (check
+        Storage.SceneIndexCV2), so there is no need to decode the previous frames.
+
+        Arguments:
+        scene_index -- SceneIndexCV2 of the video
+        scene -- index of the scene (it could be negative, as in a list)
+        """
+        self.start_frame = scene_index.get_scene(scene)[0]
+
+
+    def set_keyframes(self, scene_index):
+        """ Only return the first frame of each scene (only for video files)
+
+        Call it before iterating. The rest of frames are not decoded. Use
+        `get_frame_info` to know where each frame is inside the video.
+
+        Arguments:
+        scene_index -- SceneIndexCV2 of the video, None to return all the frames again
+        """
+        self.keyframes = list(scene_index.frames) if scene_index is not None else None
+
+
+    def detect_scene(self, frame):
+        """ Internal method to compare a frame with the previous one
+
+        Return:
+        Touple (scene_score, new_scene, frame_hash)
+        """
+        frame_hash = get_frame_hash(frame)
+        previous_frame_hash, self.previous_frame_hash = self.previous_frame_hash, frame_hash
+        if previous_frame_hash is None:
+            return 64, True, frame_hash
+
+        score = get_hash_distance(frame_hash, previous_frame_hash)
+        if self.hash_distance is not None:
+            return score, score > self.hash_distance, frame_hash
+
+        # Adaptive threshold: the usual distance plus some standard deviations of it
+        if self.scene_stats is None:
+            self.scene_stats = [0, score, 0]
+        count, mean, variance = self.scene_stats
+        threshold = mean + ManagerCV2._scene_deviations * max(variance, 4) ** 0.5
+        if count < ManagerCV2._scene_warmup_frames:
+            threshold = ManagerCV2._scene_warmup_threshold
+        new_scene = score > threshold
+        if not new_scene:
+            # Exponential moving average (a simple average while it is learning)
+            weight = max(1 / (count + 1), 0.05)
+            difference = score - mean
+            mean += weight * difference
+            variance = (1 - weight) * (variance + weight * difference ** 2)
+            self.scene_stats = [count + 1, mean, variance]
+        return score, new_scene, frame_hash
+
+
+    def set_frame_bytes(self, frame_bytes):
+        """ Internal method to calculate the maximum number of frames of the queue with the size of the frames"""
+        self.frame_bytes = frame_bytes
+        self.max_queue_depth = 1 if self.latest_frame else self.queue_size
+        if self.queue_bytes:
+            self.max_queue_depth = max(1, min(self.max_queue_depth, self.queue_bytes // frame_bytes))
+        self.queue_depth = min(self.queue_depth, self.max_queue_depth) if self.adaptive_queue else self.max_queue_depth
+        self.queue.set_depth(self.queue_depth)
+
+
+    def update_queue_depth(self):
+        """ Internal method to adapt the number of frames of the queue to the rate of the consumer"""
+        now = time.time()
+        if self.last_get_time is not None and now > self.last_get_time:
+            # Exponential moving average of the consumer rate
+            fps = 1 / (now - self.last_get_time)
+            self.consumer_fps = fps if not self.consumer_fps else 0.9 * self.consumer_fps + 0.1 * fps
+            depth = int(np.ceil(self.consumer_fps * ManagerCV2._adaptive_queue_seconds))
+            depth = max(2, min(depth, self.max_queue_depth))
+            if depth != self.queue_depth:
+                self.queue_depth = depth
+                self.queue.set_depth(depth)
+        self.last_get_time = now
+
+
+    def get_queue_occupancy(self):
+        """ Get how full is the queue
+
+        Return:
+        Dict with the number of frames in the queue ('frames'), an estimation of
+        their size in bytes ('bytes'), the current maximum number of frames
+        ('depth') and the maximum allowed by queue_size and queue_bytes ('max_depth')
+        """
+        frames = len(self.queue) if self.queue is not None else 0
+        return {
+            'frames': frames,
+            'bytes': frames * self.frame_bytes,
+            'depth': self.queue_depth,
+            'max_depth': self.max_queue_depth,
+        }
+
+
+    def read_frame(self):
+        """ Internal method to read the next frame, reusing a free buffer if it is possible"""
+        if self.shared_frames is not None:
+            return self.shared_frames.read(self.video)
+        buffer = self.frame_pool.get() if self.reuse_frames else None
+        if buffer is None:
+            return self.video.read()
+        ret, frame = self.video.read(buffer)
+        if not ret:
+            self.frame_pool.put(buffer)
+        return ret, frame
+
+
+    def lease_frame(self):
+        """ Keep the current frame (the last one returned by the iteration)
+
+        If you set reuse_frames, the buffer of each frame is reused once you ask
+        for the next one. With this method you can keep the current frame as long
+        as you want, when you don't need it anymore, call `return_frame`
+        (if you never return it, it is fine, it will be left to the garbage collector).
+
+        Return:
+        The current frame
+        """
+        frame = self.current_frame
+        self.current_frame = None
+        return frame
+
+
+    def return_frame(self, frame):
+        """ Give back a frame that you leased (check `lease_frame`), so its buffer can be reused
+
+        Arguments:
+        frame -- frame returned by `lease_frame`
+        """
+        self.recycle_frame(frame)
+
+
+    def recycle_frame(self, frame):
+        """ Internal method to give back the buffer of a frame that nobody is using"""
+        if self.shared_frames is not None:
+            self.shared_frames.put(frame)
+        elif self.reuse_frames:
+            self.frame_pool.put(frame)
 
 
     def stop_queue(self):
+        """ Internal method to indicate that there are no more frames (the consumer still gets the queued ones)"""
         self.stopped = True
-        self.queue.put((None,None))
+        self.queue.close()
+
+
+    def stop(self):
+        """ Stop reading frames and wait until the reader thread finishes
+
+        It is called at the end of the iteration, but if you leave the loop
+        before (with a break), call it to release the video.
+        """
+        self.stopped = True
+        if self.queue is not None:
+            self.queue.close()
+        if self.shared_frames is not None:
+            self.shared_frames.close()
+        if self.tracking_executor is not None:
+            # From now on, trackers are updated without threads
+            self.tracking_executor.shutdown(wait=False)
+            self.tracking_executor = None
+        if self.queue_thread is not None and self.queue_thread is not current_thread():
+            self.queue_thread.join()
+        self.video.release()
+        self.frame_pool.clear()
+
 
+    async def astop(self):
+        """ Same as `stop`, but waiting for the reader thread without blocking the event loop"""
+        await asyncio.get_running_loop().run_in_executor(None, self.stop)
 
-    def set_tracking(self, selector, frame):
+
+    def set_tracking(self, selector, frame, scale=1, workers=None):
+        """ Start tracking the zones of a selector (with dlib correlation trackers)
+
+        Then, call `get_tracking` with each new frame to update the zones.
+
+        Arguments:
+        selector -- SelectorCV2 with the zones to track
+        frame -- opencv frame object where the zones are
+
+        Keyword arguments:
+        scale -- Factor to resize the frames before tracking, for example with 0.5 the
+                 trackers work with frames of half width and height (it is a lot faster).
+                 The zones are always in the coordinates of the original frame. (Default: 1)
+        workers -- Number of threads to update the trackers in parallel (dlib releases
+                   the GIL), None means one per core, 1 means no threads. (Default: None)
+        """
+        # It is usefull if you want to track objects
+        dlib = load_backend('dlib', 'to track objects')
         self.selector_tracker = selector
         self.trackers = []
+        self.tracking_scale = scale
 
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        height, width, _ = rgb_frame.shape
+        height, width = frame.shape[:2]
+        rgb_frame = self.get_tracking_frame(frame)
 
         for selection in self.selector_tracker.zones:
             if self.selector_tracker.normalized:
-                selection = (int(selection[0]*width),
-                             int(selection[1]*height),
-                             int(selection[2]*width),
-                             int(selection[3]*height))
+                selection = (selection[0]*width, selection[1]*height, selection[2]*width, selection[3]*height)
             tracker = dlib.correlation_tracker()
-            tracker.start_track(rgb_frame, dlib.rectangle(*selection))
+            tracker.start_track(rgb_frame, dlib.rectangle(*[int(value*scale) for value in selection]))
             self.trackers.append(tracker)
 
+        # Seconds of the last update of each tracker
+        self.tracking_times = [0] * len(self.trackers)
+        workers = min(workers or os.cpu_count() or 1, len(self.trackers))
+        # The same threads are used while the number of workers doesn't change
+        if self.tracking_executor is not None and self.tracking_workers != workers:
+            self.tracking_executor.shutdown(wait=False)
+            self.tracking_executor = None
+        if self.tracking_executor is None and workers > 1:
+            self.tracking_executor = ThreadPoolExecutor(max_workers=workers)
+            self.tracking_workers = workers
+
 
     def get_tracking(self, frame):
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        height, width, _ = rgb_frame.shape
+        """ Update the zones of the selector (check `set_tracking`) with a new frame
+
+        Arguments:
+        frame -- opencv frame object
 
-        for i, tracker in enumerate(self.trackers):
-            tracker.update(rgb_frame)
-            pos = tracker.get_position()
-            selection = (int(pos.left()),int(pos.top()), int(pos.right()), int(pos.bottom()))
+        Return:
+        The selector, with its zones updated
+        """
+        height, width = frame.shape[:2]
+        rgb_frame = self.get_tracking_frame(frame)
+
+        indexes = range(len(self.trackers))
+        if self.tracking_executor is not None:
+            positions = list(self.tracking_executor.map(self.update_tracker, indexes, [rgb_frame] * len(self.trackers)))
+        else:
+            positions = [self.update_tracker(i, rgb_frame) for i in indexes]
+
+        scale = self.tracking_scale
+        for i, pos in enumerate(positions):
+            selection = (int(pos.left()/scale),int(pos.top()/scale), int(pos.right()/scale), int(pos.bottom()/scale))
             if self.selector_tracker.normalized:
                 selection = (selection[0]/width,
                              selection[1]/height,
                              selection[2]/width,
                              selection[3]/height)
-            self.selector_tracker.zones[i] = selection
+            self.selector_tracker.set_zone(i, selection)
         return self.selector_tracker
 
 
+    def detect_and_track(self, detector, *args, every=10, asynchronous=False, scale=1, workers=None, **kwargs):
+        """ Iterate the frames, detecting the zones with your detector only from time to time, and tracking them
+
+        Your detector is executed with the first frame, and then each `every` frames. With
+        each detection, the trackers are started again with the new zones (check `set_tracking`),
+        and for the rest of frames, the trackers update the zones.
+
+        If your detector is slower than the video, use asynchronous=True: it is executed
+        in a background thread (with a copy of the frame), while the trackers keep updating
+        the previous zones. When it finishes, the trackers are started again with the new
+        zones (on the frame that was detected, and then updated with the current one) and
+        it is executed again with the newest frame (after `every` frames since the previous one).
+
+        Example:
+        for frame, selector in manager_cv2.detect_and_track(face_detector, every=1, asynchronous=True):
+            cv2.imshow('Faces', selector.draw(frame))
+
+        Arguments:
+        detector -- method that detects the zones: detector(frame, *args, **kwargs), it must
+                    return a SelectorCV2 with them
+        args -- Arguments to pass to detector (after the frame)
+        kwargs -- Keyword arguments to pass to detector
+
+        Keyword arguments:
+        every -- Number of frames between detections (Default: 10)
+        asynchronous -- Bool to indicate if you want to execute the detector in a
+                        background thread (Default: False)
+        scale -- check `set_tracking` (Default: 1)
+        workers -- check `set_tracking` (Default: None)
+
+        Return:
+        Generator of touples (frame, selector), the selector has the zones of the frame
+        """
+        executor = ThreadPoolExecutor(max_workers=1) if asynchronous else None
+        # In asynchronous mode, touple (future, frame) of the detection in progress
+        detection = None
+        selector = None
+        last_detection = 0
+        try:
+            for frame in self:
+                if selector is None or (not asynchronous and self.count_frames - last_detection >= every):
+                    selector = detector(frame, *args, **kwargs)
+                    self.set_tracking(selector, frame, scale=scale, workers=workers)
+                    last_detection = self.count_frames
+                else:
+                    if detection is not None and detection[0].done():
+                        future, detected_frame = detection
+                        detection = None
+                        # The newest detection replaces the tracked zones
+                        selector = future.result()
+                        self.set_tracking(selector, detected_frame, scale=scale, workers=workers)
+                    selector = self.get_tracking(frame)
+
+                if asynchronous and detection is None and self.count_frames - last_detection >= every:
+                    detected_frame = frame.copy()
+                    detection = (executor.submit(detector, detected_frame, *args, **kwargs), detected_frame)
+                    last_detection = self.count_frames
+                yield frame, selector
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=False)
+            self.stop()
+
+
+    def get_tracking_frame(self, frame):
+        """ Internal method to get the frame for the trackers: resized (only once for all of them) and in RGB"""
+        if self.tracking_scale != 1:
+            frame = cv2.resize(frame, None, fx=self.tracking_scale, fy=self.tracking_scale, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+
+
+    def update_tracker(self, index, rgb_frame):
+        """ Internal method to update a tracker, measuring its time
+
+        Return:
+        The new position of the tracker (dlib.drectangle)
+        """
+        start = time.perf_counter()
+        tracker = self.trackers[index]
+        tracker.update(rgb_frame)
+        position = tracker.get_position()
+        self.tracking_times[index] = time.perf_counter() - start
+        return position
+
+
+    def get_tracking_times(self):
+        """ Get the seconds that each tracker took in the last update (in the same order as the zones)"""
+        return list(self.tracking_times)
+
+
     def set_ret_handler(self, method, *args, **kwargs):
         """ Method to execute when finished Video/Stream
 
@@ -322,16 +1353,23 @@ class ManagerCV2():
     def add_keystroke(self, keystroke, wait_key, *args, exit=False):
         """ Method to execute when pressed a key
 
+        All the keystrokes are checked with only one cv2.waitKey for each frame, that
+        waits the maximum wait_key of all of them (or with fps_limit, the time until the
+        next frame). If you add the same keystroke again, it replaces the previous one.
+
         Arguments:
         keystroke -- Key to check if pressed
         waitkey -- Ms to wait key (it works exactly as cv2.waitKey)
         args -- Arguments to pass to the method
         """
-        self.__keystroke_dict['keystroke'].append(keystroke)
-        self.__keystroke_dict['wait_key'].append(wait_key)
-        self.__keystroke_dict['keystroke_args'].append(args)
-        if exit:
-            self.__keystroke_dict['exit_keystrokes'].append(keystroke)
+        self.__keystrokes[keystroke] = (args, exit)
+        if self.__wait_key is None:
+            self.__wait_key = wait_key
+        elif 0 in (wait_key, self.__wait_key):
+            # 0 means forever
+            self.__wait_key = 0
+        else:
+            self.__wait_key = max(wait_key, self.__wait_key)
 
 
     def get_last_keystroke(self):
@@ -340,12 +1378,35 @@ class ManagerCV2():
 
 
     def end_iteration(self):
-        """ Internal method to finish iteration, with the previous configuration"""
-        self.stopped = True
-        self.video.release()
+        """ Internal method to finish iteration, with the previous configuration
+        (if the reader raised an exception, it is raised here)"""
+        self.finish_iteration()
+        if self.reader_error is not None:
+            raise self.reader_error
+        raise StopIteration
+
+
+    def finish_iteration(self):
+        """ Internal method to stop everything and execute the ret_handler"""
+        self.stop()
         if self.ret_handler:
             self.ret_handler(*self.ret_handler_args, **self.ret_handler_kwargs)
-        raise StopIteration
+
+
+    def get_frame_info(self):
+        """ Get where the current frame is inside the video
+
+        Return:
+        Touple (index, timestamp). index is the number of the frame in the video
+        (starting with 0, also with stride or target_fps). timestamp is its position
+        in seconds inside the video, or with streams, the time when it was read (as time.time())
+        """
+        return self.current_index, self.current_timestamp
+
+
+    def get_latency(self):
+        """ Get average seconds since each frame was read until it was consumed"""
+        return self.total_latency / self.count_frames if self.count_frames else 0
 
 
     def get_fps(self):
@@ -356,3 +1417,480 @@ class ManagerCV2():
     def is_error_last_frame(self):
         """ If we lose the last frame it will return True eoc False (only usefull for streams)"""
         return self.stream_error
+
+
+class MultiManagerCV2():
+    """ MultiManagerCV2 helps to manage a lot of videos and streams at the same time
+
+    Instead of one reader thread for each video (as ManagerCV2 does), a small
+    pool of decode threads (by default one per core) reads all of them. Each
+    video is read by only one thread at a time, and they are scheduled in turns
+    (round robin), so all of them advance at the same rate. The frames of all
+    the videos waiting to be consumed share the same memory budget.
+
+    Iterating it you get touples (source_id, frame), also in turns between the
+    videos with frames. With sync=True the frames are synchronized by their
+    timestamps instead: each time you get one frame of each video (one after
+    another, in the order of the videos), all of them from the same instant.
+    """
+
+    # Seconds between checks (while waiting) that the main thread is still alive
+    _check_interval = 0.1
+
+
+    def __init__(self, videos, is_stream=False, queue_size=8, queue_bytes=None, workers=None,
+                 sync=False, sync_tolerance=0.02):
+        """  MultiManagerCV2 constructor.
+
+        Arguments:
+        videos -- dict {source_id: cv2.VideoCapture} with the videos to manage.
+                  It could also be a list, then each source_id is its index.
+
+        Keyword arguments:
+        is_stream -- Bool to indicate if they are streams (check ManagerCV2). The timestamp of
+                     each frame of an stream is the time when it was read (as time.time()),
+                     for videos, its position inside the video. (Default: False)
+        queue_size -- The maximum number of frames to store for each video. (Default: 8)
+        queue_bytes -- The maximum number of bytes of the frames stored for all the videos together
+                       (for example 1024*2**20 are 1 GB). Each video can always keep two frames,
+                       so it is never stuck. None means no limit. (Default: None)
+        workers -- Number of decode threads, None means one per core (never more than
+                   the number of videos). (Default: None)
+        sync -- Bool to indicate if you want the frames synchronized by their timestamps.
+                Older frames are dropped (check `dropped_frames`) until all the videos have a
+                frame of the same instant. (Default: False)
+        sync_tolerance -- Maximum difference in seconds between the timestamps of synchronized
+                          frames. (Default: 0.02)
+        """
+        if not isinstance(videos, dict):
+            videos = dict(enumerate(videos))
+        self.source_ids = list(videos)
+        self.videos = list(videos.values())
+        self.is_stream = is_stream
+        self.queue_size = max(2, queue_size)
+        self.queue_bytes = queue_bytes
+        self.workers = min(workers or os.cpu_count() or 1, len(self.videos))
+        self.sync = sync
+        self.sync_tolerance = sync_tolerance
+        self.stopped = False
+        self.threads = []
+
+        self.__condition = Condition(Lock())
+        # For each video: deque of touples (frame, timestamp)
+        self.__frames = [deque() for _ in self.videos]
+        # Videos waiting for a decode thread (in order), and if each one is waiting or being read
+        self.__scheduled = deque()
+        self.__busy = [False] * len(self.videos)
+        self.__finished = [False] * len(self.videos)
+        # Size of the last frame of each video, and bytes of the frames stored (or being decoded)
+        self.__frame_bytes = [0] * len(self.videos)
+        self.__bytes = 0
+        # Index of the next video to consume
+        self.__turn = 0
+        # Synchronized frames waiting to be consumed
+        self.__group = deque()
+
+        # Additional features
+        self.initial_time = None
+        self.final_time = None
+        self.count_frames = 0
+        # Frames dropped to synchronize the videos
+        self.dropped_frames = 0
+        # Timestamp of the last consumed frame
+        self.last_timestamp = None
+
+
+    def __iter__(self):
+        # The decode threads are still running (iterating again after a break), so they continue
+        if any(thread.is_alive() for thread in self.threads):
+            if not self.stopped:
+                return self
+            for thread in self.threads:
+                thread.join()
+
+        self.initial_time = time.time()
+        self.final_time = self.initial_time
+        self.count_frames = 0
+        self.dropped_frames = 0
+        self.stopped = False
+
+        with self.__condition:
+            for i in range(len(self.videos)):
+                self.__schedule(i)
+
+        # They are not daemons, so stop can finish them cleanly
+        self.threads = [Thread(target=self.decode_frames, args=()) for _ in range(self.workers)]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+
+    def __next__(self):
+        with self.__condition:
+            while True:
+                item = self.__take_group_frame() if self.sync else self.__take_frame()
+                if item is not None:
+                    break
+                if self.stopped or all(self.__finished[i] and not frames for i, frames in enumerate(self.__frames)):
+                    break
+                self.__wait()
+
+        if item is None:
+            self.stop()
+            raise StopIteration
+
+        index, frame, timestamp = item
+        self.final_time = time.time()
+        self.count_frames += 1
+        self.last_timestamp = timestamp
+        return self.source_ids[index], frame
+
+
+    def decode_frames(self):
+        """ Internal method of each decode thread, it keeps reading the scheduled videos"""
+        while True:
+            with self.__condition:
+                while not self.__scheduled and not self.stopped:
+                    if not self.__wait():
+                        return
+                if self.stopped:
+                    return
+                index = self.__scheduled.popleft()
+                # It is reserved before decoding it
+                self.__bytes += self.__frame_bytes[index]
+
+            ret, frame, timestamp = self.read_frame(index)
+
+            with self.__condition:
+                self.__busy[index] = False
+                self.__bytes -= self.__frame_bytes[index]
+                if ret:
+                    self.__frame_bytes[index] = frame.nbytes
+                    self.__bytes += frame.nbytes
+                    self.__frames[index].append((frame, timestamp))
+                else:
+                    self.__finished[index] = True
+                self.__schedule(index)
+                self.__condition.notify_all()
+
+
+    def read_frame(self, index):
+        """ Internal method to read the next frame of a video
+
+        Return:
+        Touple (ret, frame, timestamp)
+        """
+        video = self.videos[index]
+        ret, frame = video.read()
+        # If it is a streaming we will try to reconnect
+        if self.is_stream and not ret:
+            for i in range(ManagerCV2._tries_reconnect_stream):
+                ret, frame = video.read()
+                if ret:
+                    break
+        timestamp = time.time() if self.is_stream else video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        return ret, frame, timestamp
+
+
+    def __schedule(self, index):
+        """ Internal method to schedule a video if it can read another frame (with the lock)"""
+        if self.__finished[index] or self.__busy[index]:
+            return
+        stored = len(self.__frames[index])
+        if stored >= self.queue_size:
+            return
+        if self.queue_bytes and stored >= 2 and self.__bytes + self.__frame_bytes[index] > self.queue_bytes:
+            return
+        self.__busy[index] = True
+        self.__scheduled.append(index)
+
+
+    def __release(self, index, frame):
+        """ Internal method to forget a frame that is not stored anymore (with the lock)"""
+        self.__bytes -= frame.nbytes
+        # Now there is room for other videos, starting with the next turn
+        for i in range(len(self.videos)):
+            self.__schedule((self.__turn + i) % len(self.videos))
+        self.__condition.notify_all()
+
+
+    def __take_frame(self):
+        """ Internal method to take the next frame in turns (with the lock)
+
+        Return:
+        Touple (index, frame, timestamp), None if there is no frame
+        """
+        n_videos = len(self.videos)
+        for i in range(n_videos):
+            index = (self.__turn + i) % n_videos
+            if self.__frames[index]:
+                frame, timestamp = self.__frames[index].popleft()
+                self.__turn = (index + 1) % n_videos
+                self.__release(index, frame)
+                return index, frame, timestamp
+        return None
+
+
+    def __take_group_frame(self):
+        """ Internal method to take the next synchronized frame (with the lock)
+
+        Return:
+        Touple (index, frame, timestamp), None if there is no frame
+        """
+        if not self.__group:
+            active = [i for i, frames in enumerate(self.__frames) if frames or not self.__finished[i]]
+            if not active or any(not self.__frames[i] for i in active):
+                return None
+
+            # The instant of the group is the newest of the first frames
+            instant = max(self.__frames[i][0][1] for i in active)
+            ready = True
+            for i in active:
+                frames = self.__frames[i]
+                while len(frames) > 1 and frames[1][1] <= instant + self.sync_tolerance:
+                    self.dropped_frames += 1
+                    self.__release(i, frames.popleft()[0])
+                if frames[0][1] < instant - self.sync_tolerance and not self.__finished[i]:
+                    # This video is behind, we need its next frames
+                    ready = False
+            if not ready:
+                return None
+
+            for i in active:
+                frame, timestamp = self.__frames[i].popleft()
+                self.__release(i, frame)
+                self.__group.append((i, frame, timestamp))
+        return self.__group.popleft()
+
+
+    def __wait(self):
+        """ Internal method to wait until something changes (with the lock)
+
+        Return:
+        False if the main thread finished (so nobody is going to consume the frames), True eoc
+        """
+        if not main_thread().is_alive():
+            self.stopped = True
+            self.__condition.notify_all()
+            return False
+        self.__condition.wait(MultiManagerCV2._check_interval)
+        return True
+
+
+    def get_queue_occupancy(self):
+        """ Get how full are the queues
+
+        Return:
+        Dict with the number of frames stored ('frames'), their size in bytes ('bytes')
+        and the number of frames stored of each video ('sources', {source_id: frames})
+        """
+        with self.__condition:
+            sources = {source_id: len(frames) for source_id, frames in zip(self.source_ids, self.__frames)}
+            return {
+                'frames': sum(sources.values()),
+                'bytes': sum(frame.nbytes for frames in self.__frames for frame, _ in frames),
+                'sources': sources,
+            }
+
+
+    def stop(self):
+        """ Stop reading frames and wait until the decode threads finish
+
+        It is called at the end of the iteration, but if you leave the loop
+        before (with a break), call it to release the videos.
+        """
+        with self.__condition:
+            self.stopped = True
+            self.__condition.notify_all()
+        for thread in self.threads:
+            if thread is not current_thread():
+                thread.join()
+        for video in self.videos:
+            video.release()
+
+
+    def get_fps(self):
+        """ Get average FPS (of all the videos together)"""
+        return round(self.count_frames / (self.final_time - self.initial_time),3)
+
+
+
+class ChunkedManagerCV2():
+    """ ChunkedManagerCV2 helps to decode a video file with all the cores
+
+    With only one reader, decoding is the bottleneck. ChunkedManagerCV2 splits
+    the video in ranges of frames (chunks, with `CAP_PROP_POS_FRAMES`), and each
+    range is decoded by its own thread or process, with its own VideoCapture.
+
+    You can get the results of processing each frame in order (`map`), or
+    process each chunk independently (`map_chunks`). Also you can iterate all
+    the frames in order, but then only the next `queue_size` frames of each
+    chunk are decoded in advance.
+    """
+
+
+    def __init__(self, path, chunks=None, queue_size=32):
+        """  ChunkedManagerCV2 constructor.
+
+        Arguments:
+        path -- path of the video file (each chunk opens it)
+
+        Keyword arguments:
+        chunks -- Number of ranges of frames, None means one per core (Default: None)
+        queue_size -- The maximum number of frames decoded in advance for each chunk
+                      (only iterating the frames). (Default: 32)
+        """
+        self.path = path
+        self.chunks = chunks or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.threads = []
+        self.queues = []
+        self.count_frames = 0
+        self.current_index = -1
+        self.current_timestamp = None
+
+        video = cv2.VideoCapture(path)
+        self.frame_count = int(video.get(cv2.CAP_PROP_FRAME_COUNT))
+        video.release()
+
+
+    def get_ranges(self, chunks=None):
+        """ Get the ranges of frames of each chunk
+
+        Keyword arguments:
+        chunks -- Number of ranges, None means self.chunks (Default: None)
+
+        Return:
+        List of touples (start, stop). If the number of frames of the video is
+        unknown, only one range (0, None)
+        """
+        chunks = chunks or self.chunks
+        if self.frame_count <= 0:
+            return [(0, None)]
+        limits = np.linspace(0, self.frame_count, min(chunks, self.frame_count) + 1).round().astype(int).tolist()
+        return list(zip(limits[:-1], limits[1:]))
+
+
+    def __iter__(self):
+        self.stop()
+        self.count_frames = 0
+        self.queues = []
+        self.threads = []
+        for start, stop in self.get_ranges():
+            queue = ManagerCV2.FrameRing(self.queue_size)
+            # They are not daemons, so stop can finish them cleanly
+            thread = Thread(target=self.fill_queue, args=(queue, start, stop))
+            self.queues.append(queue)
+            self.threads.append(thread)
+            thread.start()
+        self.__chunk = 0
+        return self
+
+
+    def __next__(self):
+        while self.__chunk < len(self.queues):
+            item = self.queues[self.__chunk].get()
+            if item is not None:
+                self.current_index, self.current_timestamp, frame = item
+                self.count_frames += 1
+                return frame
+            self.__chunk += 1
+        self.stop()
+        raise StopIteration
+
+
+    def fill_queue(self, queue, start, stop):
+        """ Internal method of the thread of each chunk"""
+        frames = read_chunk(self.path, start, stop)
+        try:
+            for item in frames:
+                if queue.put(item) is None:
+                    break
+        finally:
+            frames.close()
+            queue.close()
+
+
+    def map(self, func, *args, workers=None, processes=False, chunks=None, **kwargs):
+        """ Process all the frames in parallel, getting the results in order
+
+        Each chunk is decoded and processed by the same thread or process. Use
+        processes if func spends most of its time in Python (then func, args, kwargs
+        and the results must be picklable, func must be defined at the module level).
+        The results of each chunk are returned when the whole chunk is processed.
+
+        Arguments:
+        func -- method to execute with each frame: func(frame, *args, **kwargs)
+        args -- Arguments to pass to func (after the frame)
+        kwargs -- Keyword arguments to pass to func
+
+        Keyword arguments:
+        workers -- Number of threads or processes, None means one per core (Default: None)
+        processes -- Bool to indicate if you want to use processes instead of threads (Default: False)
+        chunks -- Number of ranges of frames, None means self.chunks (Default: None)
+
+        Return:
+        Generator of touples (index, timestamp, result), in the same order as the frames
+        (timestamp is the position of the frame in seconds inside the video)
+        """
+        for results in self.__submit_chunks(_process_chunk, func, args, kwargs, workers, processes, chunks):
+            yield from results
+
+
+    def map_chunks(self, func, *args, workers=None, processes=False, chunks=None, **kwargs):
+        """ Process each chunk independently and in parallel
+
+        Example:
+        def count_dark_frames(frames):
+            return sum(frame.mean() < 20 for index, timestamp, frame in frames)
+
+        total = sum(manager.map_chunks(count_dark_frames, processes=True))
+
+        Arguments:
+        func -- method to execute with each chunk: func(frames, *args, **kwargs),
+                frames is a generator of touples (index, timestamp, frame) (check `read_chunk`)
+        args -- Arguments to pass to func (after the frames)
+        kwargs -- Keyword arguments to pass to func
+
+        Keyword arguments:
+        workers -- Number of threads or processes, None means one per core (Default: None)
+        processes -- Bool to indicate if you want to use processes instead of threads (Default: False)
+        chunks -- Number of ranges of frames, None means self.chunks (Default: None)
+
+        Return:
+        Generator with the result of each chunk, in the same order as the chunks
+        """
+        return self.__submit_chunks(_process_chunk_frames, func, args, kwargs, workers, processes, chunks)
+
+
+    def __submit_chunks(self, task, func, args, kwargs, workers, processes, chunks):
+        """ Internal method to execute task with each chunk in a pool, getting the results in order"""
+        workers = workers or os.cpu_count() or 1
+        executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=workers)
+        futures = [executor.submit(task, self.path, start, stop, func, args, kwargs)
+                   for start, stop in self.get_ranges(chunks)]
+        try:
+            for future in futures:
+                yield future.result()
+        finally:
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=True)
+
+
+    def get_frame_info(self):
+        """ Get where the current frame is inside the video (check ManagerCV2.get_frame_info)"""
+        return self.current_index, self.current_timestamp
+
+
+    def stop(self):
+        """ Stop reading frames and wait until the threads of the chunks finish
+
+        It is called at the end of the iteration, but if you leave the loop
+        before (with a break), call it to release the videos.
+        """
+        for queue in self.queues:
+            queue.close()
+        for thread in self.threads:
+            if thread is not current_thread():
+                thread.join()
@@ -1,8 +1,11 @@
 # MIT License
 # Copyright (c) 2019 Fernando Perez
+import numpy as np
 import cv2
 
 from cv2_tools.Utils import *
+from cv2_tools.Composition import CompositorCV2
+from cv2_tools.tags_constraint import GridIndex, TagsLayoutMemory
 
 
 class SelectorCV2():
@@ -21,7 +24,7 @@ class SelectorCV2():
 
     def __init__(self, alpha=0.9, color=(110,70,45), polygon_color=(110,45,93), color_by_tag={}, normalized=False,
                  thickness=2, filled=False, peephole=True, margin=5, closed_polygon=False,
-                 show_vertexes=False):
+                 show_vertexes=False, stable_tags=False):
         """  SelectorCV2 constructor.
 
         Keyword arguments:
@@ -40,6 +43,8 @@ class SelectorCV2():
         margin -- extra margin in pixels to be separeted with the selected zone (default 5)
         closed_polygon -- boolean parameter, if True, when you pass a polygon, it will draw the polygon closing it (default False)
         show_vertexes -- boolean parameter, if True, when you pass a polygon, it will draw small circles on each vertex (default False)
+        stable_tags -- boolean parameter, if True, each zone (by its index) keeps the side of its tags between calls to draw
+                       while it is still valid. Usefull in videos, tags don't flicker and it is faster (default False)
         """
 
         self.zones = []
@@ -57,6 +62,8 @@ class SelectorCV2():
         self.peephole = peephole
         self.margin = margin
         self.show_vertexes = show_vertexes
+        self.stable_tags = stable_tags
+        self.tags_layout = TagsLayoutMemory()
         # Polygon
         self.closed_polygon = closed_polygon
         # From index (polygon_zones) -> {
@@ -66,11 +73,17 @@ class SelectorCV2():
         #   'peephole': peephole,
         # }
         self.specific_properties = {}
+        # Used by draw(composite=True), it keeps its buffers between frames
+        self.compositor = CompositorCV2()
+        # Used by draw(coordinates=...), it is built again only when the zones change
+        self.__zones_index = None
+        self.__indexed_zones = None
+        self.__indexed_len = 0
 
 
     def set_properties(self, alpha=None, color=None, polygon_color=None, color_by_tag=None,
                        normalized=None, thickness=None, filled=None, peephole=None,
-                       margin=None, closed_polygon=None, show_vertexes=None):
+                       margin=None, closed_polygon=None, show_vertexes=None, stable_tags=None):
         """  Set default properties.
 
         Note: All parameters are setted to None, but this is because, this method
@@ -92,6 +105,7 @@ class SelectorCV2():
         peephole -- boolean parameter, if True, it also draws additional effects, so it looks like a peephole (default None)
         margin -- extra margin in pixels to be separeted with the selected zone (default None)
         closed_polygon -- boolean parameter, if True, when you pass a polygon, it will draw the polygon closing it (default None)
+        stable_tags -- boolean parameter, if True, each zone keeps the side of its tags between calls to draw (default None)
         """
         if alpha is not None:
             self.alpha = alpha
@@ -115,6 +129,8 @@ class SelectorCV2():
             self.closed_polygon = closed_polygon
         if show_vertexes is not None:
             self.show_vertexes = show_vertexes
+        if stable_tags is not None:
+            self.stable_tags = stable_tags
 
 
     def add_zone(self, zone, tags=None, specific_properties={}):
@@ -146,7 +162,8 @@ class SelectorCV2():
         """
         if not self.normalized:
             zone = [int(x) for x in zone]
-        self.zones.append(zone)
+        self.zones.append(tuple(zone))
+        self.__zones_index = None
         if tags and type(tags) is not list:
             tags = [tags]
         elif not tags:
@@ -197,6 +214,7 @@ class SelectorCV2():
                     max_y = position[1]
 
             self.zones.append((min_x, min_y, max_x, max_y))
+            self.__zones_index = None
 
             if tags and type(tags) is not list:
                 tags = [tags]
@@ -252,11 +270,14 @@ class SelectorCV2():
         """ It is going to be proably a deprecated method """
         self.zones = self.zones[origin:destination]
         self.all_tags = self.all_tags[origin:destination]
+        self.__zones_index = None
 
 
     def set_valid_rectangles(self, indexes):
         """ It is going to be proably a deprecated method """
 
+        self.__zones_index = None
+
         # This if is just for efficiency
         if not indexes:
             self.zones = []
@@ -269,7 +290,38 @@ class SelectorCV2():
                 self.all_tags.pop(i)
 
 
-    def draw(self, frame, coordinates=(-1,-1), draw_tags=True, fx=1, fy=1, interpolation=cv2.INTER_LINEAR):
+    def set_zone(self, index, zone):
+        """  Replace the position of a zone, keeping its tags and properties.
+
+        Arguments:
+        index -- index of the zone (in the order they were added)
+        zone -- tuple with 4 elements (x1, y1, x2, y2), as in add_zone
+        """
+        if not self.normalized:
+            zone = [int(x) for x in zone]
+        self.zones[index] = tuple(zone)
+        self.__zones_index = None
+
+
+    def get_zones_index(self):
+        """ Get a GridIndex with the current zones, to know quickly which zones
+        are in some position.
+
+        It is only built again when the zones change through the methods of
+        SelectorCV2 (add_zone, set_zone, ...) or when self.zones is replaced
+        by another list, so don't modify the zones of self.zones directly
+        (use set_zone instead).
+        """
+        if (self.__zones_index is None or self.__indexed_zones is not self.zones
+                or self.__indexed_len != len(self.zones)):
+            self.__indexed_zones = self.zones
+            self.__indexed_len = len(self.zones)
+            self.__zones_index = GridIndex(self.zones)
+        return self.__zones_index
+
+
+    def draw(self, frame, coordinates=(-1,-1), draw_tags=True, fx=1, fy=1, interpolation=cv2.INTER_LINEAR,
+             composite=False, in_place=False, out=None):
         """  Draw all selections.
 
         Arguments:
@@ -284,23 +336,51 @@ class SelectorCV2():
         fx -- frame horizonal scale (default 1)
         fy -- frame vertical scale (default 1)
         interpolation -- cv2 default scaling algorithm (default cv2.INTER_LINEAR)
+        composite -- boolean value, if True, all the selections and tags are
+                     collected first and blended with the frame once for each
+                     different alpha value (check CompositorCV2). It is much
+                     faster with a lot of zones, but overlapped elements are
+                     blended only once (default False)
+        in_place -- boolean value, if True, it draws directly on the given frame
+                    instead of on a copy of it, so the original frame is modified
+                    (default False)
+        out -- optional preallocated frame where the result is written (with
+               the final size, after scaling). Usefull to avoid allocating a new
+               frame on each call (default None)
+
+        Return:
+        The drawed frame (out if provided)
         """
+        compositor = self.compositor if composite else None
+        scaled = fx != 1 or fy != 1
+
+        if out is not None:
+            height, width = frame.shape[:2]
+            if scaled:
+                height, width = int(round(height*fy)), int(round(width*fx))
+            if out.shape != (height, width) + frame.shape[2:] or out.dtype != frame.dtype:
+                raise ValueError('out must have shape {} and dtype {}'.format(
+                    (height, width) + frame.shape[2:], frame.dtype))
+
+        # Select the buffer where we are going to draw
+        if in_place:
+            next_frame = frame
+        elif out is not None and not scaled:
+            np.copyto(out, frame)
+            next_frame = out
+        else:
+            next_frame = frame.copy()
 
         if coordinates != (-1,-1):
-            all_tags = []
-            for zone, tags in zip(self.zones, self.all_tags):
-                # zone = (x1,y1,x2,y2)
-                if coordinates[0] >= zone[0] and coordinates[0] <= zone[2] and \
-                   coordinates[1] >= zone[1] and coordinates[1] <= zone[3]:
-                    all_tags.append(tags)
-                else:
-                    all_tags.append([])
+            # Only the zones (x1,y1,x2,y2) that contain the coordinates keep their tags
+            selected = set(self.get_zones_index().query_point(*coordinates))
+            all_tags = [tags if i in selected else [] for i, tags in enumerate(self.all_tags[:len(self.zones)])]
         else:
             all_tags = self.all_tags
 
         # Step 1: Draw polygons
         next_frame = select_polygon(
-            frame.copy(),
+            next_frame,
             all_vertexes=self.polygon_zones,
             color=self.polygon_color,
             thickness=self.thickness,
@@ -321,7 +401,9 @@ class SelectorCV2():
             peephole=self.peephole,
             margin=self.margin,
             color_by_tag=self.color_by_tag,
-            specific_properties=self.specific_properties)
+            specific_properties=self.specific_properties,
+            compositor=compositor,
+            layout_memory=self.tags_layout if self.stable_tags else None)
 
         # Step 3: Draw free tags
         for free_tag in self.free_tags:
@@ -331,7 +413,17 @@ class SelectorCV2():
                 free_tag['tags'],
                 alpha=free_tag['alpha'],
                 color=free_tag['color'],
-                font_info=free_tag['font_info']
+                font_info=free_tag['font_info'],
+                compositor=compositor
             )
 
-        return cv2.resize(next_frame, (0,0), fx=fx, fy=fy, interpolation=interpolation)
+        if compositor is not None:
+            next_frame = compositor.compose(next_frame)
+
+        if scaled:
+            return cv2.resize(next_frame, (out.shape[1], out.shape[0]) if out is not None else (0,0),
+                              dst=out, fx=fx, fy=fy, interpolation=interpolation)
+        if out is not None and next_frame is not out:
+            np.copyto(out, next_frame)
+            return out
+        return next_frame
@@ -1,11 +1,15 @@
 # MIT License
 # Copyright (c) 2019 Fernando Perez
+from cv2_tools.Management import ManagerCV2
 from cv2_tools.Selection import SelectorCV2
 import cv2_tools
 
+import cv2
 import base64
-import zlib
+import bisect
 import json
+import os
+import zlib
 
 def json_zip(original_dict):
     """ Internal function. It receives a dict and generates a comppressed dict with metadata"""
@@ -224,3 +228,205 @@ class StorageCV2():
 
         with open(path, 'w') as outfile:
             json.dump(json_zip(self.complete_structure), outfile)
+
+
+class SceneIndexCV2():
+    """ SceneIndexCV2 helps to save and load the scenes of a video.
+
+    Detecting the scenes of a video (check ManagerCV2 detect_scenes) requires
+    to decode all of it. With this class you can do it only once: build the
+    index, save it next to the video, and then load it to jump directly to a
+    scene (ManagerCV2.seek_scene) or to process only the first frame of each
+    scene (ManagerCV2.set_keyframes).
+
+    For each scene it keeps its first frame: its index inside the video, its
+    timestamp (in seconds), its hash (check Management.get_frame_hash) and the
+    distance with the hash of the previous frame.
+
+    Json data structure (before compression):
+
+    {
+        'video': {
+            'frame_count': frame_count,
+            'fps': fps,
+            'scene_threshold': scene_threshold,
+            'size': size,
+            'mtime_ns': mtime_ns
+        },
+        'frames': [frame_index, ...],
+        'timestamps': [timestamp, ...],
+        'hashes': [hash, ...],
+        'scores': [distance, ...]
+    }
+
+    The size and modification time (in nanoseconds) of the video file are
+    stored too, so a different video with the same name and length is not
+    taken as the same one.
+
+    It is stored compressed, as StorageCV2 does.
+    """
+
+
+    def __init__(self, path=''):
+        """  SceneIndexCV2 constructor.
+
+        Keyword arguments:
+        path -- Path of the index to load. (default '')
+        """
+        self.video = {}
+        self.frames = []
+        self.timestamps = []
+        self.hashes = []
+        self.scores = []
+        if path:
+            self.load_from_file(path)
+
+
+    def __len__(self):
+        return len(self.frames)
+
+
+    @staticmethod
+    def get_index_path(video_path):
+        """ Get the path of the index of a video (next to the video)"""
+        return video_path + '.scenes.json'
+
+
+    @staticmethod
+    def get_video_info(video, video_path, scene_threshold=25):
+        """ Get the information of a video stored in the index (check the json data structure)
+
+        Arguments:
+        video -- cv2.VideoCapture of the video
+        video_path -- path of the video file
+
+        Keyword arguments:
+        scene_threshold -- check ManagerCV2 scene_threshold (default 25)
+        """
+        stat = os.stat(video_path)
+        return {
+            'frame_count': int(video.get(cv2.CAP_PROP_FRAME_COUNT)),
+            'fps': video.get(cv2.CAP_PROP_FPS),
+            'scene_threshold': scene_threshold,
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+        }
+
+
+    @classmethod
+    def build(cls, video_path, scene_threshold=25, save=True):
+        """ Detect the scenes of a video file and get its index
+
+        Arguments:
+        video_path -- path of the video file
+
+        Keyword arguments:
+        scene_threshold -- check ManagerCV2 scene_threshold (default 25)
+        save -- Bool to indicate if you want to save the index next to the video (default True)
+
+        Return:
+        SceneIndexCV2 with the scenes of the video
+        """
+        video = cv2.VideoCapture(video_path)
+        scene_index = cls()
+        scene_index.video = cls.get_video_info(video, video_path, scene_threshold=scene_threshold)
+        manager = ManagerCV2(video, queue_size=16, reuse_frames=True, detect_scenes=True, scene_threshold=scene_threshold)
+        for frame in manager:
+            if manager.new_scene:
+                scene_index.add_scene(*manager.get_frame_info(), manager.frame_hash, manager.scene_score)
+
+        if save:
+            scene_index.save(cls.get_index_path(video_path))
+        return scene_index
+
+
+    @classmethod
+    def load_or_build(cls, video_path, scene_threshold=25):
+        """ Load the index next to the video, or build it (and save it) if it doesn't exist
+        or it doesn't match the video (another frame_count, fps, scene_threshold, size
+        or modification time)
+
+        Arguments:
+        video_path -- path of the video file
+
+        Keyword arguments:
+        scene_threshold -- check ManagerCV2 scene_threshold (default 25)
+
+        Return:
+        SceneIndexCV2 with the scenes of the video
+        """
+        index_path = cls.get_index_path(video_path)
+        if os.path.exists(index_path):
+            scene_index = cls(index_path)
+            video = cv2.VideoCapture(video_path)
+            video_info = cls.get_video_info(video, video_path, scene_threshold=scene_threshold)
+            video.release()
+            if scene_index.video == video_info:
+                return scene_index
+        return cls.build(video_path, scene_threshold=scene_threshold)
+
+
+    def add_scene(self, frame, timestamp, frame_hash, score):
+        """ Method to add a new scene (they must be added in order)
+
+        Arguments:
+        frame -- index of the first frame of the scene inside the video
+        timestamp -- position of that frame in seconds
+        frame_hash -- hash of that frame
+        score -- distance between its hash and the hash of the previous frame
+        """
+        self.frames.append(frame)
+        self.timestamps.append(timestamp)
+        self.hashes.append(frame_hash)
+        self.scores.append(score)
+
+
+    def get_scene(self, scene):
+        """ Get where a scene starts
+
+        Arguments:
+        scene -- index of the scene (it could be negative, as in a list)
+
+        Return:
+        Touple (frame, timestamp) of its first frame
+        """
+        return self.frames[scene], self.timestamps[scene]
+
+
+    def find_scene(self, frame):
+        """ Get the index of the scene of a frame
+
+        Arguments:
+        frame -- index of the frame inside the video
+
+        Return:
+        The index of the scene, -1 if it is before the first scene
+        """
+        return bisect.bisect_right(self.frames, frame) - 1
+
+
+    def load_from_file(self, path):
+        """ Internal method to load data from file(path)"""
+
+        with open(path) as json_file:
+            structure = json_unzip(json.load(json_file))
+
+        self.video = structure['video']
+        self.frames = structure['frames']
+        self.timestamps = structure['timestamps']
+        self.hashes = structure['hashes']
+        self.scores = structure['scores']
+
+
+    def save(self, path):
+        """ Method to save the index (compressed) into file (path)"""
+
+        structure = {
+            'video': self.video,
+            'frames': self.frames,
+            'timestamps': self.timestamps,
+            'hashes': self.hashes,
+            'scores': self.scores,
+        }
+        with open(path, 'w') as outfile:
+            json.dump(json_zip(structure), outfile)
@@ -5,6 +5,10 @@ import time
 import sys
 import cv2
 
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+
 from cv2_tools.tags_constraint import *
 
 
@@ -16,6 +20,12 @@ from cv2_tools.tags_constraint import *
 """
 IGNORE_ERRORS = True
 
+"""
+    Maximum number of different tags (with its font configuration) whose
+    metrics are remembered by get_text_metrics.
+"""
+TEXT_METRICS_CACHE_SIZE = 4096
+
 
 def eprint(*args, **kwargs):
     """Internal method to print into stderr"""
@@ -38,6 +48,130 @@ def get_lighter_color(color):
     return (color[0] + add, color[1] + add, color[2] + add)
 
 
+def get_primitives_region(shape, primitives):
+    """Auxiliar Method: Get the region of the frame touched by a list of primitives.
+
+    Arguments:
+    shape -- touple with 2 elements (height, width)
+             this information should be the height and width of the frame.
+             If None, the region is not clipped.
+    primitives -- list of primitives (check draw_primitives)
+
+    Return:
+    Touple (x1, y1, x2, y2) clipped to the frame (x2 and y2 are exclusive)
+    or None if the primitives are completely outside of the frame
+
+    """
+    if not primitives:
+        return None
+
+    f_height, f_width = shape if shape is not None else (float('inf'), float('inf'))
+    x1, y1, x2, y2 = float('inf'), float('inf'), -float('inf'), -float('inf')
+    for primitive in primitives:
+        if primitive[0] == 'contour':
+            points, pad = primitive[1], 1
+        else:
+            points, pad = primitive[1:3], max(primitive[4], 1) + 1
+        for x, y in points:
+            # Comparisons are faster than calling min/max for each point
+            if x - pad < x1:
+                x1 = x - pad
+            if y - pad < y1:
+                y1 = y - pad
+            if x + pad + 1 > x2:
+                x2 = x + pad + 1
+            if y + pad + 1 > y2:
+                y2 = y + pad + 1
+
+    if shape is None:
+        return (int(x1), int(y1), int(x2), int(y2))
+
+    x1, y1 = int(max(x1, 0)), int(max(y1, 0))
+    x2, y2 = int(min(x2, f_width)), int(min(y2, f_height))
+    if x1 >= x2 or y1 >= y2:
+        return None
+    return (x1, y1, x2, y2)
+
+
+def draw_primitives(canvas, primitives, offset=(0, 0), color=None):
+    """Auxiliar Method: Draw a list of primitives on a canvas.
+
+    Each primitive is a touple with one of the following structures:
+        ('line', pt1, pt2, color, thickness)
+        ('rectangle', pt1, pt2, color, thickness)
+        ('contour', points, color) -> filled polygon
+
+    Arguments:
+    canvas -- opencv frame object (or a region of it) where you want to draw
+    primitives -- list of primitives
+
+    Keyword arguments:
+    offset -- touple (x, y) with the position of the canvas inside the frame
+              the primitives refer to (default (0, 0))
+    color -- if provided, it replaces the color of every primitive. Usefull to
+             draw masks (default None)
+
+    Return:
+    The drawed canvas
+
+    """
+    ox, oy = offset
+    for primitive in primitives:
+        if primitive[0] == 'contour':
+            _, points, primitive_color = primitive
+            cv2.drawContours(canvas, [np.array(points) - (ox, oy)], 0,
+                             primitive_color if color is None else color, -1)
+            continue
+
+        kind, pt1, pt2, primitive_color, thickness = primitive
+        pt1 = (pt1[0] - ox, pt1[1] - oy)
+        pt2 = (pt2[0] - ox, pt2[1] - oy)
+        if color is not None:
+            primitive_color = color
+        if kind == 'line':
+            cv2.line(canvas, pt1, pt2, primitive_color, thickness)
+        else:
+            cv2.rectangle(canvas, pt1, pt2, primitive_color, thickness)
+    return canvas
+
+
+def blend_primitives(frame, primitives, alpha, compositor=None):
+    """Draw a list of primitives with transparency.
+
+    Only the region of the frame covered by the primitives is copied and
+    blended, so the cost depends on the size of the primitives and not on
+    the size of the frame. The result is the same as drawing them over a copy
+    of the whole frame and blending it with cv2.addWeighted.
+
+    Arguments:
+    frame -- opencv frame object where you want to draw
+    primitives -- list of primitives (check draw_primitives)
+    alpha -- transparency of the primitives on the image
+             1 means totally visible and 0 totally invisible
+
+    Keyword arguments:
+    compositor -- CompositorCV2 object. If provided, the primitives are not
+                  drawed yet, they are added to the compositor (default None)
+
+    Return:
+    The same frame, drawed
+
+    """
+    if compositor is not None:
+        compositor.add_primitives(primitives, alpha)
+        return frame
+
+    region = get_primitives_region(frame.shape[:2], primitives)
+    if region is None:
+        return frame
+
+    x1, y1, x2, y2 = region
+    roi = frame[y1:y2, x1:x2]
+    overlay = draw_primitives(roi.copy(), primitives, offset=(x1, y1))
+    roi[:] = cv2.addWeighted(overlay, alpha, roi, 1 - alpha, 0)
+    return frame
+
+
 def calculate_video_fps(video, stream=False):
     """Calculate frames per second of a video or streaming.
     If it is a video, we will get the data at real time.
@@ -75,6 +209,44 @@ def calculate_video_fps(video, stream=False):
     return fps
 
 
+@lru_cache(maxsize=TEXT_METRICS_CACHE_SIZE)
+def get_text_metrics(tags, font, font_scale, thickness):
+    """Auxiliar Method: Split the tags in lines and measure them.
+
+    Labels use to be always the same ones (like "person 0.93"), so the result
+    is cached (it is thread-safe and it remembers the last
+    TEXT_METRICS_CACHE_SIZE different calls). You can check the hits and misses
+    of the cache with get_text_metrics.cache_info() and clean it with
+    get_text_metrics.cache_clear().
+
+    Arguments:
+    tags -- touple of strings/tags you want to measure (it must be hashable)
+    font -- opencv font
+    font_scale -- scale of the font
+    thickness -- thickness of the text in pixels
+
+    Return:
+    Touple (lines, text_width, text_height) where lines is a touple with every
+    line of the tags (all of them except the first line of each tag end with
+    '\n'), and text_width and text_height are the maximum width and height of
+    the lines
+
+    """
+    lines = []
+    for tag in tags:
+        line = [x+'\n' for x in tag.split('\n')]
+        line[0] = line[0][:-1]
+        lines.extend(line)
+
+    text_width = -1
+    text_height = -1
+    for line in lines:
+        size = cv2.getTextSize(line, font, font_scale, thickness)
+        text_width = max(text_width, size[0][0])
+        text_height = max(text_height, size[0][1])
+    return tuple(lines), text_width, text_height
+
+
 def get_shape_tags(tags, font_info=(cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1)):
     """Get information about how much the list of tags will occupy (width and height)
     with the current configuration.
@@ -95,29 +267,189 @@ def get_shape_tags(tags, font_info=(cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,2
     """
     margin = 5
     font, font_scale, font_color, thickness = font_info
+    tags, text_width, text_height = get_text_metrics(tuple(tags), font, font_scale, thickness)
 
-    aux_tags = []
-    for tag in tags:
-        line = [x+'\n' for x in tag.split('\n')]
-        line[0] = line[0][:-1]
-        for element in line:
-            aux_tags.append(element)
-    tags = aux_tags
+    return (text_width + margin * 3, (margin + text_height)*(len(tags) - 1) + 2*text_height + margin*(len(tags)-1))
 
-    text_width = -1
-    text_height = -1
-    line_height = -1
-    for tag in tags:
-        size = cv2.getTextSize(tag, font, font_scale, thickness)
-        text_width = max(text_width,size[0][0])
-        text_height = max(text_height, size[0][1])
-        line_height = max(line_height, text_height + size[1] + margin)
 
-    return (text_width + margin * 3, (margin + text_height)*(len(tags) - 1) + 2*text_height + margin*(len(tags)-1))
+def get_tags_layout(tags, text_width, text_height, inside, margin=5):
+    """Auxiliar Method: Get where the backgrounds and the texts of the tags are drawn.
+
+    All the positions are relative to the anchor of the tags: its x is the left
+    side of the backgrounds and its y is the top of the selected zone when the
+    tags are 'inside' or 'top', or the bottom of the zone in other case.
+
+    Arguments:
+    tags -- lines of the tags (as returned by get_text_metrics)
+    text_width -- maximum width of the lines
+    text_height -- maximum height of the lines
+    inside -- boolean parameter, True if the tags are inside the selected zone
+
+    Keyword arguments:
+    margin -- margin in pixels around the text (default 5)
+
+    Return:
+    Touple (backgrounds, texts). backgrounds is a list of touples (pt1, pt2) with
+    the corners of each background rectangle and texts a list of touples
+    (text, origin) with the text of each line and its bottom-left corner
+
+    """
+    backgrounds = []
+    texts = []
+    for i, tag in enumerate(tags):
+        reverse_i = len(tags) - i
+        extra_adjustment = 2 if len(tag) > 1 and tag[-1] == '\n' else 1
+        text_adjustment = int(margin*( 0.5 if tag[-1] == '\n' else 0))
+        if inside:
+            backgrounds.append(((0, (margin*2 + text_height)*(i+1) + margin*i - text_height - margin * extra_adjustment),
+                                (text_width + margin*2, (margin*2 + text_height)*(i+1) + margin*i + text_height - margin)))
+            texts.append((tag.replace('\n',''), (margin, (margin*2 + text_height)*(i+1) + margin*i - text_adjustment)))
+        else:
+            backgrounds.append(((0, - (margin + text_height)*reverse_i - margin * (reverse_i-1) - text_height - margin * (extra_adjustment - 1)),
+                                (text_width + margin*2, - (margin + text_height)*reverse_i - margin * (reverse_i) + text_height)))
+            texts.append((tag.replace('\n',''), (margin, - (margin + text_height)*reverse_i - margin * (reverse_i-1) + int(margin/2) - text_adjustment)))
+    return backgrounds, texts
+
+
+class SpriteCache():
+    """ Thread-safe cache of pre-rendered sprites, limited by its size in bytes.
+
+    When it is full, the least recently used sprites are removed.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.__sprites = OrderedDict()
+        self.__lock = Lock()
+
+    def get(self, key):
+        """ Get the sprite associated with the key (None if it doesn't exist)"""
+        with self.__lock:
+            stored = self.__sprites.get(key)
+            if stored is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.__sprites.move_to_end(key)
+            return stored[0]
+
+    def put(self, key, sprite, size):
+        """ Add a sprite that uses size bytes"""
+        with self.__lock:
+            if key in self.__sprites:
+                return
+            self.__sprites[key] = (sprite, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes and len(self.__sprites) > 1:
+                _, (_, removed_size) = self.__sprites.popitem(last=False)
+                self.current_bytes -= removed_size
+
+    def clear(self):
+        """ Remove all the sprites and reset the counters"""
+        with self.__lock:
+            self.__sprites.clear()
+            self.current_bytes = self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self.__sprites)
+
+
+"""
+    Pre-rendered tags (backgrounds and texts). You can change its max_bytes.
+"""
+TAG_SPRITES = SpriteCache(max_bytes=32 * 2**20)
+
+
+def get_tag_sprite(tags, text_width, text_height, inside, color, font_info, margin=5):
+    """Auxiliar Method: Get the background of the tags rendered in a small tile.
+
+    Tags rarely change between frames, so each different tile is rendered only
+    once and stored in TAG_SPRITES, together with where each line of text goes.
+
+    Arguments:
+    tags -- lines of the tags (as returned by get_text_metrics)
+    text_width -- maximum width of the lines
+    text_height -- maximum height of the lines
+    inside -- boolean parameter, True if the tags are inside the selected zone
+    color -- color of the tags background
+    font_info -- touple with 4 elements (font, font_scale, font_color, thickness)
+
+    Keyword arguments:
+    margin -- margin in pixels around the text (default 5)
+
+    Return:
+    Touple (tile, background_mask, texts, offset, font_info).
+    tile is a BGR image with the background color, background_mask says which
+    pixels are background, texts is a list of touples (text, (x, y)) with the
+    origin of each line relative to the anchor of the tags and offset is the
+    position of the tile relative to the anchor of the tags
+
+    """
+    font, font_scale, font_color, thickness = font_info
+    key = (tuple(tags), inside, tuple(color), font, font_scale, tuple(font_color), thickness, margin)
+    sprite = TAG_SPRITES.get(key)
+    if sprite is not None:
+        return sprite
+
+    backgrounds, texts = get_tags_layout(tags, text_width, text_height, inside, margin=margin)
+
+    # Region of the tile (rectangles include their second corner)
+    x1, y1 = min(pt1[0] for pt1, _ in backgrounds), min(pt1[1] for pt1, _ in backgrounds)
+    x2, y2 = max(pt2[0] for _, pt2 in backgrounds) + 1, max(pt2[1] for _, pt2 in backgrounds) + 1
+
+    tile = np.zeros((y2 - y1, x2 - x1, 3), dtype=np.uint8)
+    background_mask = np.zeros(tile.shape[:2], dtype=np.uint8)
+    for pt1, pt2 in backgrounds:
+        pt1, pt2 = (pt1[0] - x1, pt1[1] - y1), (pt2[0] - x1, pt2[1] - y1)
+        cv2.rectangle(tile, pt1, pt2, color, -1)
+        cv2.rectangle(background_mask, pt1, pt2, 255, -1)
+
+    # The text is not pre-rendered: antialiased glyphs can overlap, and then cv2.putText blends
+    # some pixels more than once, so only drawing it again over the frame gives the same result
+    # (and for a few lines it is faster than blending the pixels of the text with numpy)
+    sprite = (tile, background_mask, tuple(texts), (x1, y1), font_info)
+    TAG_SPRITES.put(key, sprite, tile.nbytes + background_mask.nbytes)
+    return sprite
+
+
+def blit_tag_sprite(frame, sprite, anchor, alpha):
+    """Auxiliar Method: Draw a tags sprite on the frame.
+
+    The background is blended with the frame and then the text is drawn over it.
+
+    Arguments:
+    frame -- opencv frame object where you want to draw
+    sprite -- touple returned by get_tag_sprite
+    anchor -- touple (x, y) with the anchor of the tags in the frame
+    alpha -- transparency of the tags background on the image
+
+    Return:
+    The same frame, drawed
+
+    """
+    tile, background_mask, texts, (offset_x, offset_y), (font, font_scale, font_color, thickness) = sprite
+    f_height, f_width = frame.shape[:2]
+    x, y = anchor[0] + offset_x, anchor[1] + offset_y
+    height, width = tile.shape[:2]
+
+    # Clip the tile to the frame
+    tx1, ty1 = max(0, -x), max(0, -y)
+    tx2, ty2 = min(width, f_width - x), min(height, f_height - y)
+    if tx1 < tx2 and ty1 < ty2:
+        roi = frame[y + ty1:y + ty2, x + tx1:x + tx2]
+        blended = cv2.addWeighted(tile[ty1:ty2, tx1:tx2], alpha, roi, 1 - alpha, 0)
+        cv2.copyTo(blended, background_mask[ty1:ty2, tx1:tx2], roi)
+
+    for text, (text_x, text_y) in texts:
+        cv2.putText(frame, text, (text_x + anchor[0], text_y + anchor[1]), font, font_scale, font_color, thickness)
+    return frame
 
 
 def draw_free_tag(frame, coordinates, tags, alpha=0.75, color=(20,20,20),
-                  font_info=(cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1)):
+                  font_info=(cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1), compositor=None):
     """Add tags to selected zone.
 
     It was originally intended as an auxiliary method to add details to the select_zone()
@@ -152,13 +484,14 @@ def draw_free_tag(frame, coordinates, tags, alpha=0.75, color=(20,20,20),
             y = f_height - height + coordinates[1] - 2*margin
 
     return add_tags(frame, Rectangle(x, y, x, y), tags, tag_position='inside',
-                    alpha=alpha, color=color, font_info=font_info)
+                    alpha=alpha, color=color, font_info=font_info, compositor=compositor)
 
 
 def add_tags(frame, position, tags, tag_position=None, alpha=0.75, color=(20, 20, 20),
              font_info=(cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1),
              tags_order_priority=('top', 'inside', 'bottom_right', 'bottom_left'),
-             multitags_order_priority=('bottom_right', 'bottom_left', 'inside', 'top')):
+             multitags_order_priority=('bottom_right', 'bottom_left', 'inside', 'top'),
+             compositor=None):
     """Add tags to selected zone.
 
     It was originally intended as an auxiliary method to add details to the select_zone()
@@ -188,6 +521,8 @@ def add_tags(frame, position, tags, tag_position=None, alpha=0.75, color=(20, 20
                  font_color -- color of the tags text, touple with 3 elements BGR (default (255,255,255) -> white)
                           BGR = Blue - Green - Red
                  thickness -- thickness of the text in pixels (default 1)
+    compositor -- CompositorCV2 object. If provided, the tags are added to it
+                  instead of being drawed on the frame (default None)
 
     Return:
     A new drawed Frame
@@ -199,23 +534,7 @@ def add_tags(frame, position, tags, tag_position=None, alpha=0.75, color=(20, 20
     margin = 5
     f_height, f_width = frame.shape[:2]
     font, font_scale, font_color, thickness = font_info
-
-    aux_tags = []
-    for tag in tags:
-        line = [x+'\n' for x in tag.split('\n')]
-        line[0] = line[0][:-1]
-        for element in line:
-            aux_tags.append(element)
-    tags = aux_tags
-
-    text_width = -1
-    text_height = -1
-    line_height = -1
-    for tag in tags:
-        size = cv2.getTextSize(tag, font, font_scale, thickness)
-        text_width = max(text_width,size[0][0])
-        text_height = max(text_height, size[0][1])
-        line_height = max(line_height, text_height + size[1] + margin)
+    tags, text_width, text_height = get_text_metrics(tuple(tags), font, font_scale, thickness)
 
     '''
         If not tags position are provided:
@@ -225,7 +544,8 @@ def add_tags(frame, position, tags, tag_position=None, alpha=0.75, color=(20, 20
             - If it doesn't fit, try to put the text On top of the rectangle
     '''
     if not tag_position:
-        extra_adjustment = 2 if len(tag) > 1 and tag[-1] == '\n' else 1
+        last_tag = tags[-1]
+        extra_adjustment = 2 if len(last_tag) > 1 and last_tag[-1] == '\n' else 1
 
         vertical_fit = position.y2 - (margin + text_height)*len(tags) - margin * (len(tags)-1) - text_height - margin * (extra_adjustment - 1) >= position.y1
         horizontal_fit = text_width + margin*3 <= position.x2 - position.x1
@@ -276,52 +596,37 @@ def add_tags(frame, position, tags, tag_position=None, alpha=0.75, color=(20, 20
         pt3 = (int((pt1[0] + pt2[0])/2), pt1[1] + margin*2 - 1)
 
     if tag_position != 'inside':
-        overlay = frame.copy()
-        cv2.drawContours(overlay, [np.array([pt1, pt2, pt3])], 0, color, -1)
-        cv2.addWeighted(overlay, alpha, frame, 1-alpha, 0, frame)
+        frame = blend_primitives(frame, [('contour', [pt1, pt2, pt3], color)], alpha, compositor=compositor)
 
-    overlay = frame.copy()
-    for i, tag in enumerate(tags):
-        reverse_i = len(tags) - i
-        extra_adjustment = 2 if len(tag) > 1 and tag[-1] == '\n' else 1
-        if tag_position == 'top':
-            cv2.rectangle(overlay, (position.x1 + margin, position.y1 - (margin + text_height)*reverse_i - margin * (reverse_i-1) - text_height - margin * (extra_adjustment - 1 )),
-                          (position.x1 + text_width + margin*3, position.y1 - (margin + text_height)*reverse_i - margin * (reverse_i) + text_height), color,-1)
-        elif tag_position == 'inside':
-            cv2.rectangle(overlay, (position.x1 + margin, position.y1 + (margin*2 + text_height)*(i+1) + margin*i - text_height - margin * extra_adjustment),
-                          (position.x1 + text_width + margin*3, position.y1 + (margin*2 + text_height)*(i+1) + margin*i + text_height - margin), color,-1)
-        elif tag_position == 'bottom_left':
-            cv2.rectangle(overlay, (position.x1 - (text_width + margin*3), position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i-1) - text_height - margin * (extra_adjustment - 1)),
-                          (position.x1 - margin, position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i) + text_height), color,-1)
-        elif tag_position == 'bottom_right':
-            cv2.rectangle(overlay, (position.x2 + margin, position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i-1) - text_height - margin * (extra_adjustment - 1)),
-                          (position.x2 + text_width + margin*3, position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i) + text_height), color,-1)
-
-    cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
-    for i, tag in enumerate(tags):
-        reverse_i = len(tags) - i
-        extra_adjustment = int(margin*( 0.5 if tag[-1] == '\n' else 0))
-        if tag_position == 'top':
-            cv2.putText(frame, tag.replace('\n',''),
-                        (position.x1 + margin*2, position.y1 - (margin + text_height)*reverse_i - margin * (reverse_i-1) + int(margin/2) - extra_adjustment),
-                        font, font_scale, font_color, thickness)
-        elif tag_position == 'inside':
-            cv2.putText(frame, tag.replace('\n',''),
-                        (position.x1 + margin*2, position.y1 + (margin*2 + text_height)*(i+1) + margin*i - extra_adjustment),
-                        font, font_scale, font_color, thickness)
-        elif tag_position == 'bottom_left':
-            cv2.putText(frame, tag.replace('\n',''),
-                        (position.x1 - (text_width + margin*2), position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i-1) + int(margin/2) - extra_adjustment),
-                        font, font_scale, font_color, thickness)
-        elif tag_position == 'bottom_right':
-            cv2.putText(frame, tag.replace('\n',''),
-                        (position.x2 + margin*2, position.y2 - (margin + text_height)*reverse_i - margin * (reverse_i-1) + int(margin/2) - extra_adjustment),
-                        font, font_scale, font_color, thickness)
+    # Top-left corner of the tags backgrounds (horizontally) and base line of the tags (vertically)
+    if tag_position == 'bottom_right':
+        anchor = (position.x2 + margin, position.y2)
+    elif tag_position == 'bottom_left':
+        anchor = (position.x1 - (text_width + margin*3), position.y2)
+    else:
+        anchor = (position.x1 + margin, position.y1)
+    inside = tag_position == 'inside'
+
+    # Sprites are BGR tiles, other frames (grayscale, BGRA...) are drawed directly
+    if compositor is None and frame.ndim == 3 and frame.shape[2] == 3:
+        sprite = get_tag_sprite(tags, text_width, text_height, inside, color, font_info, margin=margin)
+        return blit_tag_sprite(frame, sprite, anchor, alpha)
+
+    backgrounds, texts = get_tags_layout(tags, text_width, text_height, inside, margin=margin)
+    ax, ay = anchor
+    frame = blend_primitives(frame, [('rectangle', (ax + pt1[0], ay + pt1[1]), (ax + pt2[0], ay + pt2[1]), color, -1)
+                                     for pt1, pt2 in backgrounds], alpha, compositor=compositor)
+    for text, origin in texts:
+        if compositor is None:
+            cv2.putText(frame, text, (ax + origin[0], ay + origin[1]), *font_info)
+        else:
+            compositor.add_text(text, (ax + origin[0], ay + origin[1]), font_info)
 
     return frame
 
 
-def add_peephole(frame, position, alpha=0.5, color=(110,70,45), thickness=2, line_length=7, corners=True):
+def add_peephole(frame, position, alpha=0.5, color=(110,70,45), thickness=2, line_length=7, corners=True,
+                 compositor=None):
     """Add peephole effect to the select_zone.
 
     It was originally intended as an auxiliary method to add details to the select_zone()
@@ -343,6 +648,8 @@ def add_peephole(frame, position, alpha=0.5, color=(110,70,45), thickness=2, lin
                   else you shold provide concrete values (default False)
     thickness -- thickness of the drawing in pixels (default 2)
     corners -- boolean parameter, if True, also draw the corners of the rectangle
+    compositor -- CompositorCV2 object. If provided, the peephole is added to it
+                  instead of being drawed on the frame (default None)
 
     Return:
     A new drawed Frame
@@ -352,24 +659,24 @@ def add_peephole(frame, position, alpha=0.5, color=(110,70,45), thickness=2, lin
     thickness = min(thickness,2)
     # If the selected zone is too small don't draw
     if position.x2 - position.x1 > thickness*2 + line_length  and position.y2 - position.y1 > thickness*2 + line_length:
-        overlay = frame.copy()
+        lines = []
         if corners:
             # Draw horizontal lines of the corners
-            cv2.line(overlay,(position.x1, position.y1),(position.x1 + line_length, position.y1), color, thickness+1)
-            cv2.line(overlay,(position.x2, position.y1),(position.x2 - line_length, position.y1), color, thickness+1)
-            cv2.line(overlay,(position.x1, position.y2),(position.x1 + line_length, position.y2), color, thickness+1)
-            cv2.line(overlay,(position.x2, position.y2),(position.x2 - line_length, position.y2), color, thickness+1)
+            lines.append(('line', (position.x1, position.y1),(position.x1 + line_length, position.y1), color, thickness+1))
+            lines.append(('line', (position.x2, position.y1),(position.x2 - line_length, position.y1), color, thickness+1))
+            lines.append(('line', (position.x1, position.y2),(position.x1 + line_length, position.y2), color, thickness+1))
+            lines.append(('line', (position.x2, position.y2),(position.x2 - line_length, position.y2), color, thickness+1))
             # Draw vertical lines of the corners
-            cv2.line(overlay,(position.x1, position.y1),(position.x1, position.y1 + line_length), color, thickness+1)
-            cv2.line(overlay,(position.x1, position.y2),(position.x1, position.y2 - line_length), color, thickness+1)
-            cv2.line(overlay,(position.x2, position.y1),(position.x2, position.y1 + line_length), color, thickness+1)
-            cv2.line(overlay,(position.x2, position.y2),(position.x2, position.y2 - line_length), color, thickness+1)
+            lines.append(('line', (position.x1, position.y1),(position.x1, position.y1 + line_length), color, thickness+1))
+            lines.append(('line', (position.x1, position.y2),(position.x1, position.y2 - line_length), color, thickness+1))
+            lines.append(('line', (position.x2, position.y1),(position.x2, position.y1 + line_length), color, thickness+1))
+            lines.append(('line', (position.x2, position.y2),(position.x2, position.y2 - line_length), color, thickness+1))
         # Added extra lines that gives the peephole effect
-        cv2.line(overlay,(position.x1, int((position.y1 + position.y2) / 2)),(position.x1 + line_length, int((position.y1 + position.y2) / 2)), color, max(1,thickness-1))
-        cv2.line(overlay,(position.x2, int((position.y1 + position.y2) / 2)),(position.x2 - line_length, int((position.y1 + position.y2) / 2)), color, max(1,thickness-1))
-        cv2.line(overlay,(int((position.x1 + position.x2) / 2), position.y1),(int((position.x1 + position.x2) / 2), position.y1 + line_length), color, max(1,thickness-1))
-        cv2.line(overlay,(int((position.x1 + position.x2) / 2), position.y2),(int((position.x1 + position.x2) / 2), position.y2 - line_length), color, max(1,thickness-1))
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+        lines.append(('line', (position.x1, int((position.y1 + position.y2) / 2)),(position.x1 + line_length, int((position.y1 + position.y2) / 2)), color, max(1,thickness-1)))
+        lines.append(('line', (position.x2, int((position.y1 + position.y2) / 2)),(position.x2 - line_length, int((position.y1 + position.y2) / 2)), color, max(1,thickness-1)))
+        lines.append(('line', (int((position.x1 + position.x2) / 2), position.y1),(int((position.x1 + position.x2) / 2), position.y1 + line_length), color, max(1,thickness-1)))
+        lines.append(('line', (int((position.x1 + position.x2) / 2), position.y2),(int((position.x1 + position.x2) / 2), position.y2 - line_length), color, max(1,thickness-1)))
+        frame = blend_primitives(frame, lines, alpha, compositor=compositor)
     return frame
 
 
@@ -423,6 +730,53 @@ def adjust_position(shape, position, normalized=False, thickness=0):
     return position
 
 
+def adjust_positions(shape, positions, normalized=False, thickness=0, return_out_of_bounds=False):
+    """Auxiliar Method: Adjust a lot of positions at once, exactly as adjust_position does with each one.
+
+    Arguments:
+    shape -- touple with 2 elements (height, width)
+             this information should be the height and width of the frame.
+    positions -- list of touples or numpy array (N, 4) with (x1, y1, x2, y2)
+                 This elements must be between 0 and 1 in case it is normalized
+                 or between 0 and frame height/width.
+
+    Keyword arguments:
+    normalized -- boolean parameter, if True, positions provided normalized (between 0 and 1)
+                  else you shold provide concrete values (default False)
+    thickness -- thickness of the drawing in pixels (default 0)
+    return_out_of_bounds -- boolean parameter, if True, it also returns how many
+                            values were outside the frame (default False)
+
+    Return:
+    A new numpy array (N, 4) of ints with all the adjustments. If some values
+    were outside the frame, only one warning is shown for all of them.
+    With return_out_of_bounds, touple (positions, out_of_bounds)
+
+    """
+    f_height, f_width = shape
+    positions = np.array(positions, dtype=np.float64).reshape(-1, 4)
+    limits = np.array((f_width, f_height, f_width, f_height), dtype=np.float64)
+    if normalized:
+        positions *= limits
+
+    out_of_bounds = int(np.count_nonzero((positions < 0) | (positions > limits)))
+    if out_of_bounds:
+        eprint('Warning: {} values out of bounds; Values must be between 0 and {} (x) or {} (y). If normalized between 0 and 1.'.format(
+            out_of_bounds, f_width, f_height))
+        np.minimum(np.maximum(positions, 0), limits, out=positions)
+
+    # Auto adjust the limits of the selected zones (same order as adjust_position)
+    x1, y1, x2, y2 = positions.T
+    x2 = np.trunc(np.minimum(np.maximum(x2, thickness*2), f_width - thickness))
+    y2 = np.trunc(np.minimum(np.maximum(y2, thickness*2), f_height - thickness))
+    x1 = np.minimum(np.maximum(x1, thickness), x2 - thickness)
+    y1 = np.minimum(np.maximum(y1, thickness), y2 - thickness)
+    positions = np.stack([x1, y1, x2, y2], axis=1).astype(np.int64)
+    if return_out_of_bounds:
+        return positions, out_of_bounds
+    return positions
+
+
 def adjust_polygon(shape, point, normalized=False, thickness=0):
     """Auxiliar Method: Adjust provided position to select_zone.
 
@@ -494,7 +848,8 @@ def select_polygon(frame, all_vertexes, normalized=False, color=(110,70,45), thi
     return frame
 
 
-def select_zone_dict(frame, position, tags=[], tag_position=None, normalized=False, margin=5, other_parameters={}):
+def select_zone_dict(frame, position, tags=[], tag_position=None, normalized=False, margin=5, other_parameters={},
+                     compositor=None):
     """ Draw better rectangles to select zones.
 
     This is an alternative of select_zone. We use it in case we have specific
@@ -526,6 +881,8 @@ def select_zone_dict(frame, position, tags=[], tag_position=None, normalized=Fal
                       one-third opacity compared to the rectangle (default False)
             peephole -- boolean parameter, if True, also draw additional effect,
                         to make it looks like a peephole
+    compositor -- CompositorCV2 object. If provided, the zone is added to it
+                  instead of being drawed on the frame (default None)
 
     Return:
     A new point with all the adjustments
@@ -534,11 +891,11 @@ def select_zone_dict(frame, position, tags=[], tag_position=None, normalized=Fal
             alpha=other_parameters['alpha'], color=other_parameters['color'],
             normalized=normalized, thickness=other_parameters['thickness'],
             filled=other_parameters['filled'], peephole=other_parameters['peephole'],
-            margin=margin)
+            margin=margin, compositor=compositor)
 
 
 def select_zone(frame, position, tags=[], tag_position=None, alpha=0.9, color=(110,70,45),
-                normalized=False, thickness=2, filled=False, peephole=True, margin=5):
+                normalized=False, thickness=2, filled=False, peephole=True, margin=5, compositor=None):
     """Draw better rectangles to select zones.
 
     Arguments:
@@ -565,6 +922,8 @@ def select_zone(frame, position, tags=[], tag_position=None, alpha=0.9, color=(1
     filled -- boolean parameter, if True, will draw a filled rectangle with one-third opacity compared to the rectangle (default False)
     peephole -- boolean parameter, if True, also draw additional effect, so it looks like a peephole
     margin -- extra margin in pixels to be separeted with the selected zone (default 5)
+    compositor -- CompositorCV2 object. If provided, the zone is added to it
+                  instead of being drawed on the frame (default None)
 
     Return:
     A new drawed Frame
@@ -577,24 +936,24 @@ def select_zone(frame, position, tags=[], tag_position=None, alpha=0.9, color=(1
     # If thickness is 0 or less we can just avoid to draw any rectangle
     if thickness > 0:
         if peephole:
-            frame = add_peephole(frame, position, thickness=thickness, alpha=alpha, color=color)
+            frame = add_peephole(frame, position, thickness=thickness, alpha=alpha, color=color,
+                                 compositor=compositor)
 
         if filled:
-            overlay = frame.copy()
-            cv2.rectangle(overlay, (position.x1, position.y1), (position.x2, position.y2), color,thickness=cv2.FILLED)
-            cv2.addWeighted(overlay, alpha/3.0, frame, 1 - alpha/3.0, 0, frame)
+            frame = blend_primitives(frame, [('rectangle', (position.x1, position.y1), (position.x2, position.y2), color, cv2.FILLED)],
+                                     alpha/3.0, compositor=compositor)
 
-        overlay = frame.copy()
-        cv2.rectangle(overlay, (position.x1, position.y1), (position.x2, position.y2), color,thickness=thickness)
-        cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+        frame = blend_primitives(frame, [('rectangle', (position.x1, position.y1), (position.x2, position.y2), color, thickness)],
+                                 alpha, compositor=compositor)
 
-    frame = add_tags(frame, position, tags, tag_position=tag_position)
+    frame = add_tags(frame, position, tags, tag_position=tag_position, compositor=compositor)
     return frame
 
 
 def select_multiple_zones(frame, all_selected_zones, all_tags=None, alpha=0.9, color=(110,70,45),
                 normalized=False, thickness=2, filled=False, peephole=True, margin=5,
-                color_by_tag={}, specific_properties={}):
+                color_by_tag={}, specific_properties={}, compositor=None, place_tags=True,
+                layout_memory=None):
     """Draw better rectangles to select multiple zones at the same time.
     It will put tags to the rectangles as better as possible, avoiding (if it is possible) overwritten information.
 
@@ -620,28 +979,36 @@ def select_multiple_zones(frame, all_selected_zones, all_tags=None, alpha=0.9, c
     margin -- extra margin in pixels to be separeted with the selected zone (default 5)
     color_by_tag -- dict from string to color (BGR). The string is the first tag of a selection.
                     So, if you want to draw a class with a color, you can easily do it. (default {})
+    compositor -- CompositorCV2 object. If provided, the zones are added to it
+                  instead of being drawed on the frame (default None)
+    place_tags -- boolean parameter, if True, the tags of all the zones are placed
+                  together, avoiding overlaps between them and other zones (default True)
+    layout_memory -- TagsLayoutMemory object. If provided, each zone keeps the side
+                     of its tags from the previous call while it is still valid,
+                     so tags don't flicker in videos (default None)
 
     Return:
     A new drawed Frame
 
     """
-    all_selected_zones = [adjust_position(frame.shape[:2],
-                              Rectangle(zone[0],zone[1],zone[2],zone[3]),
-                              normalized=normalized, thickness=thickness)
-                          for zone in all_selected_zones]
+    zones = adjust_positions(frame.shape[:2], [zone[:4] for zone in all_selected_zones],
+                             normalized=normalized, thickness=thickness)
+    all_selected_zones = [Rectangle(*zone) for zone in zones.tolist()]
 
     f_height, f_width = frame.shape[:2]
     all_tags_shapes = []
     best_position = []
 
-    if all_tags:
+    if all_tags and place_tags:
         for i, zone in enumerate(all_selected_zones):
-            all_tags_shapes.append(get_shape_tags(all_tags[i]))
+            tags = all_tags[i] if i < len(all_tags) else None
+            if type(tags) is str:
+                tags = [tags]
+            all_tags_shapes.append(get_shape_tags(tags) if tags else None)
         # Here you could pass the frame if you want to see where get_possible_positions
         # thinks the tags will be.           Just: frame=frame     \/
-        best_position = None
-        #best_position = get_possible_positions(f_width, f_height, all_selected_zones,
-        #                all_tags_shapes, margin=margin, frame=[])
+        best_position = get_possible_positions(f_width, f_height, zones,
+                        all_tags_shapes, margin=margin, frame=[], memory=layout_memory)
 
     for i, zone in enumerate(all_selected_zones):
         tags = None
@@ -666,14 +1033,15 @@ def select_multiple_zones(frame, all_selected_zones, all_tags=None, alpha=0.9, c
                 specific_properties[i]['thickness'] = thickness
 
             frame = select_zone_dict(frame,zone, tags=tags,tag_position=position,
-                    normalized=normalized,margin=margin, other_parameters=specific_properties[i])
+                    normalized=normalized,margin=margin, other_parameters=specific_properties[i],
+                    compositor=compositor)
         else:
             final_color = color
             if tags and tags[0] in color_by_tag:
                 final_color = color_by_tag[tags[0]]
             frame = select_zone(frame, zone, tags=tags, tag_position=position,
                     alpha=alpha, color=final_color, thickness=thickness, filled=filled,
-                    peephole=peephole, margin=margin)
+                    peephole=peephole, margin=margin, compositor=compositor)
     return frame
 
 
@@ -8,8 +8,15 @@ For more information visit: https://github.com/fernaper/cv2-tools
 Also you can write complete_help to view full information'''
 __version__ = '2.4.0'
 
-complete_help = '''
+
+def __getattr__(attr):
+    """ complete_help is only built the first time you ask for it"""
+    if attr == 'complete_help':
+        global complete_help
+        complete_help = '''
 {} - v{}
 {}
 {}
 '''.format(name, __version__, help, get_complete_help())
+        return complete_help
+    raise AttributeError("module '{}' has no attribute '{}'".format(__name__, attr))
@@ -1,4 +1,4 @@
-from constraint import *
+import numpy as np
 import cv2
 
 class Rectangle():
@@ -50,79 +50,496 @@ def is_valid(position, frame_shape, other_selected_zones):
         position.y2 > position.y1 and position.x2 <= width and position.y2 <= height and \
         not rectangle_collision_list_rectangles(position, other_selected_zones)
 
-def get_possible_positions(width, height, all_selected_zones, all_tags_shapes, margin=5, frame=[]):
-    problem = Problem()
-    conflict_zones = []
-    for i, rectangle in enumerate(all_selected_zones):
-        tag_width, tag_height = all_tags_shapes[i]
-        bottom_right = Rectangle(rectangle.x2, rectangle.y2 - tag_height - margin, rectangle.x2 + tag_width, rectangle.y2 - margin*2)
-        bottom_left  = Rectangle(rectangle.x1 - tag_width, rectangle.y2 - tag_height - margin, rectangle.x1, rectangle.y2 - margin*2)
-        inside       = Rectangle(rectangle.x1, rectangle.y1, rectangle.x1 + tag_width, rectangle.y1 + tag_height + margin*2)
-        top          = Rectangle(rectangle.x1 + margin, rectangle.y1 - tag_height - margin, rectangle.x1 + tag_width, rectangle.y1)
-
-        sides = [(bottom_right, 'bottom_right'),
-                (bottom_left, 'bottom_left'),
-                (inside, 'inside'),
-                (top, 'top')]
-        valid_sides = []
-        other_selected_zones = all_selected_zones[:i] + all_selected_zones[i+1:]
-        for side in sides:
-            # Only accepts zones inside the frame with tags not inside other selections
-            if is_valid(side[0], (width,height), other_selected_zones):
-                valid_sides.append(side)
-        if valid_sides:
-            problem.addVariable('zone_{}'.format(i), valid_sides)
-        else:
-            conflict_zones.append(i)
+def overlap_matrix(rectangles1, rectangles2):
+    """ Boolean numpy array (N, M) that says if each pair of rectangles overlaps (borders included)"""
+    # Comparisons between contiguous coordinates are faster
+    a, b = np.ascontiguousarray(rectangles1.T)[:, :, None], np.ascontiguousarray(rectangles2.T)[:, None, :]
+    overlapped = a[0] <= b[2]
+    overlapped &= b[0] <= a[2]
+    overlapped &= a[1] <= b[3]
+    overlapped &= b[1] <= a[3]
+    return overlapped
+
+
+class GridIndex():
+    """ GridIndex answers which rectangles overlap other rectangles (or points).
+
+    The rectangles (x1, y1, x2, y2) are stored in a uniform grid: each cell of
+    the grid knows which rectangles touch it, so a query only checks the
+    rectangles of the cells it touches instead of all of them. Everything is
+    kept in numpy arrays, so a lot of queries can be answered at once with
+    `query_pairs`.
+
+    With a few rectangles (up to `dense_rectangles`) the grid costs more than
+    it saves, so each query is checked against all of them at once.
+
+    Borders are included, as in `overlap`: rectangles that only share a border
+    overlap.
+    """
+
+    # Maximum number of rectangles checked without the grid
+    dense_rectangles = 256
+
+    def __init__(self, rectangles, cell_size=None):
+        """  GridIndex constructor.
+
+        Arguments:
+        rectangles -- list of touples or numpy array (N, 4) with (x1, y1, x2, y2)
+
+        Keyword arguments:
+        cell_size -- size of each cell of the grid. If None, it is twice the
+                     median size of the rectangles (default None)
+        """
+        rectangles = np.asarray(rectangles)
+        if rectangles.dtype.kind not in 'iuf':
+            rectangles = rectangles.astype(np.float64)
+        self.rectangles = rectangles.reshape(-1, 4)
+        self.dense = len(self.rectangles) <= GridIndex.dense_rectangles
+        if self.dense:
+            return
+
+        if cell_size is None:
+            sizes = np.concatenate([self.rectangles[:, 2] - self.rectangles[:, 0],
+                                    self.rectangles[:, 3] - self.rectangles[:, 1]])
+            cell_size = 2 * float(np.median(sizes)) if len(sizes) else 1
+        self.cell_size = cell_size if cell_size > 0 else 1
+        self.origin = self.rectangles[:, :2].min(axis=0) if len(self.rectangles) else np.zeros(2)
+
+        x1, y1, x2, y2 = self.__cells(self.rectangles)
+        self.n_cols = int(x2.max()) + 1 if len(x2) else 0
+        self.n_rows = int(y2.max()) + 1 if len(y2) else 0
+        self.first_cells = (x1, y1)
+        rectangle_ids, cells = self.__expand(x1, y1, x2, y2)
+
+        # Rectangles sorted by cell, and where each cell starts and ends
+        order = np.argsort(cells, kind='stable')
+        self.cell_rectangles = rectangle_ids[order]
+        cells = cells[order]
+        starts = np.flatnonzero(np.diff(cells, prepend=-1))
+        self.cell_keys = cells[starts]
+        self.cell_starts = starts
+        self.cell_ends = np.append(starts[1:], len(cells))
+
+
+    def __len__(self):
+        return len(self.rectangles)
+
+
+    def query_pairs(self, rectangles):
+        """ Find all the pairs of overlapped rectangles, between the given ones and the indexed ones.
+
+        Arguments:
+        rectangles -- list of touples or numpy array (M, 4) with (x1, y1, x2, y2)
+
+        Return:
+        Touple of two numpy arrays (queries, indexed) with the same length, the
+        rectangle queries[k] (of the given ones) overlaps indexed[k]
+        """
+        rectangles = np.asarray(rectangles).reshape(-1, 4)
+        if self.dense:
+            # Much faster than np.nonzero with 2 dimensions
+            return np.divmod(np.flatnonzero(overlap_matrix(rectangles, self.rectangles)), len(self.rectangles))
+
+        empty = np.empty(0, dtype=np.int64)
+        if not len(rectangles) or not len(self.cell_keys):
+            return empty, empty
+
+        x1, y1, x2, y2 = self.__cells(rectangles)
+        np.clip(x1, 0, None, out=x1)
+        np.clip(y1, 0, None, out=y1)
+        np.clip(x2, None, self.n_cols - 1, out=x2)
+        np.clip(y2, None, self.n_rows - 1, out=y2)
+        query_ids, cells = self.__expand(x1, y1, x2, y2)
+
+        # Cells with some rectangle inside
+        positions = np.searchsorted(self.cell_keys, cells)
+        positions[positions == len(self.cell_keys)] = 0
+        found = self.cell_keys[positions] == cells
+        query_ids, cells, positions = query_ids[found], cells[found], positions[found]
+        starts, counts = self.cell_starts[positions], self.cell_ends[positions] - self.cell_starts[positions]
+
+        # One candidate pair for each rectangle in each cell
+        total = int(counts.sum())
+        if not total:
+            return empty, empty
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        queries = np.repeat(query_ids, counts)
+        cells = np.repeat(cells, counts)
+        indexed = self.cell_rectangles[np.repeat(starts, counts) + offsets]
+
+        # The same pair could appear in more than one cell, we only keep it in
+        # the first cell shared by both rectangles
+        keep = (cells % self.n_cols == np.maximum(x1[queries], self.first_cells[0][indexed])) & \
+               (cells // self.n_cols == np.maximum(y1[queries], self.first_cells[1][indexed]))
+        queries, indexed = queries[keep], indexed[keep]
+        a, b = rectangles[queries], self.rectangles[indexed]
+        overlapped = (a[:, 0] <= b[:, 2]) & (b[:, 0] <= a[:, 2]) & (a[:, 1] <= b[:, 3]) & (b[:, 1] <= a[:, 3])
+        return queries[overlapped], indexed[overlapped]
+
+
+    def query(self, rectangle):
+        """ Indexes (sorted) of the rectangles that overlap the given one (x1, y1, x2, y2)"""
+        return sorted(self.query_pairs([rectangle])[1].tolist())
+
+
+    def query_point(self, x, y):
+        """ Indexes (sorted) of the rectangles that contain the point (x, y)"""
+        return self.query((x, y, x, y))
+
+
+    def __cells(self, rectangles):
+        """ Internal method to get the cells (x1, y1, x2, y2) where each rectangle is (both included)"""
+        cells = np.floor((rectangles - np.tile(self.origin, 2)) / self.cell_size).astype(np.int64)
+        return cells[:, 0], cells[:, 1], np.maximum(cells[:, 2], cells[:, 0] - 1), np.maximum(cells[:, 3], cells[:, 1] - 1)
+
+
+    def __expand(self, x1, y1, x2, y2):
+        """ Internal method to get one (id, cell) pair for each cell covered by each rectangle"""
+        widths, heights = x2 - x1 + 1, y2 - y1 + 1
+        counts = np.where((widths > 0) & (heights > 0), widths * heights, 0)
+        total = int(counts.sum())
+        ids = np.repeat(np.arange(len(x1)), counts)
+        local = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        widths = widths[ids]
+        cells = (y1[ids] + local // widths) * self.n_cols + x1[ids] + local % widths
+        return ids, cells
+
+
+"""
+    Sides where the tags of a selected zone can be placed, from the best to the worst one
+    (scores 4, 3, 2 and 1).
+"""
+SIDES = ('bottom_right', 'bottom_left', 'inside', 'top')
+_SIDE_BITS = 1 << np.arange(len(SIDES))
+_VALID_SIDES = [[side for side in range(len(SIDES)) if bits & (1 << side)] for bits in range(1 << len(SIDES))]
+
+
+def get_candidate_positions(zones, shapes, margin=5):
+    """ Rectangles (x1, y1, x2, y2) where the tags of each zone would be on each side.
+
+    Arguments:
+    zones -- numpy array (N, 4) with the selected zones (x1, y1, x2, y2)
+    shapes -- numpy array (N, 2) with the (width, height) of the tags of each zone
+
+    Keyword arguments:
+    margin -- extra margin in pixels to be separeted with the selected zone (default 5)
+
+    Return:
+    numpy array (N, 4, 4), with the rectangles of each side in the same order as SIDES
+    """
+    x1, y1, x2, y2 = zones.T
+    tag_width, tag_height = shapes.T
+    candidates = np.empty((len(zones), len(SIDES), 4), dtype=np.int32)
+    candidates[:, 0] = np.stack([x2, y2 - tag_height - margin, x2 + tag_width, y2 - margin*2], axis=1)
+    candidates[:, 1] = np.stack([x1 - tag_width, y2 - tag_height - margin, x1, y2 - margin*2], axis=1)
+    candidates[:, 2] = np.stack([x1, y1, x1 + tag_width, y1 + tag_height + margin*2], axis=1)
+    candidates[:, 3] = np.stack([x1 + margin, y1 - tag_height - margin, x1 + tag_width, y1], axis=1)
+    return candidates
+
+
+def get_candidates_region(candidates):
+    """ Region (x1, y1, x2, y2) covered by all the sides of each zone.
+
+    Arguments:
+    candidates -- numpy array (N, 4, 4) returned by get_candidate_positions
+
+    Return:
+    numpy array (N, 4)
+    """
+    # With only 4 sides, this is faster than min and max along their axis
+    regions = np.empty((len(candidates), 4), dtype=candidates.dtype)
+    np.minimum(np.minimum(candidates[:, 0, :2], candidates[:, 1, :2]),
+               np.minimum(candidates[:, 2, :2], candidates[:, 3, :2]), out=regions[:, :2])
+    np.maximum(np.maximum(candidates[:, 0, 2:], candidates[:, 1, 2:]),
+               np.maximum(candidates[:, 2, 2:], candidates[:, 3, 2:]), out=regions[:, 2:])
+    return regions
+
 
-    for i in range(len(all_selected_zones)):
-        if i in conflict_zones:
+def overlap(rectangle1, rectangle2):
+    """ Check if two rectangles (x1, y1, x2, y2) overlap (borders included)"""
+    return rectangle1[0] <= rectangle2[2] and rectangle2[0] <= rectangle1[2] and \
+           rectangle1[1] <= rectangle2[3] and rectangle2[1] <= rectangle1[3]
+
+
+class TagsLayoutMemory():
+    """ TagsLayoutMemory remembers where the tags of each zone were placed.
+
+    In a video the zones move only a few pixels from one frame to the next one,
+    so if you pass the same TagsLayoutMemory to get_possible_positions on each
+    frame, each zone keeps the side it had in the previous frame while it is
+    still valid (inside the frame, not over other zones and not over other
+    tags). Only the zones that lost their side or are new are placed again,
+    so tags do not flicker. Zones that couldn't be placed are only tried again
+    when some zone near them changes (nothing else can free their space), and
+    if no zone changes at all, the previous sides are returned directly.
+
+    Zones are identified by their index in the list of zones.
+    """
+
+    def __init__(self):
+        """  TagsLayoutMemory constructor."""
+        self.clear()
+
+
+    def clear(self):
+        """ Forget all the sides"""
+        # Zone index -> index of its side in SIDES (None if it couldn't be placed)
+        self.sides = {}
+        # Everything used in the previous layout: (width, height, margin), zones (N, 4),
+        # shapes (N, 2), with_tags (N,) and the region (N, 4) that each zone and its tags can cover
+        self.layout = None
+        self.zones = None
+        self.shapes = None
+        self.with_tags = None
+        self.regions = None
+        # Result of the previous layout (check get_possible_positions)
+        self.positions = []
+
+
+    def is_unchanged(self, layout, zones, shapes, with_tags):
+        """ Check if the zones (and their tags) are the same of the previous layout"""
+        return self.layout == layout and self.zones is not None and np.array_equal(self.zones, zones) and \
+               np.array_equal(self.shapes, shapes) and np.array_equal(self.with_tags, with_tags)
+
+
+    def get_zones_to_place(self, layout, regions, with_tags, kept):
+        """ Get the zones that must be placed (they have tags but not a kept side).
+
+        Zones that couldn't be placed in the previous layout are only included
+        when some zone changed (or lost its side) near them.
+
+        Arguments:
+        layout -- touple (width, height, margin)
+        regions -- numpy array (N, 4) with the region that each zone and its tags can cover
+        with_tags -- boolean numpy array (N,), True if the zone has tags
+        kept -- dict returned by get_kept_sides
+
+        Return:
+        Boolean numpy array (N,)
+        """
+        to_place = with_tags.copy()
+        to_place[list(kept)] = False
+        unplaced = np.array([i for i, side in self.sides.items() if side is None and i < len(regions) and with_tags[i]],
+                            dtype=np.int64)
+        if not len(unplaced) or self.layout != layout or len(self.regions) != len(regions):
+            return to_place
+
+        changed = np.any(self.regions != regions, axis=1) | (self.with_tags != with_tags)
+        changed[[i for i, side in self.sides.items() if side is not None and i not in kept]] = True
+        # When most of the zones changed, almost all of them would be near one
+        if changed.sum() * 2 > len(changed):
+            return to_place
+        # Old and new regions of the changed zones
+        areas = np.concatenate([self.regions[changed], regions[changed]])
+        near = np.zeros(len(unplaced), dtype=bool)
+        near[GridIndex(regions[unplaced]).query_pairs(areas)[1]] = True
+        to_place[unplaced[~near]] = False
+        return to_place
+
+
+    def update(self, layout, zones, shapes, with_tags, regions, placed, positions):
+        """ Remember a new layout (check get_possible_positions)"""
+        self.sides = {i: placed.get(i) for i in np.flatnonzero(with_tags).tolist()}
+        self.layout = layout
+        # The zones could be the array of the caller (it could change it)
+        self.zones, self.shapes, self.with_tags, self.regions = zones.copy(), shapes, with_tags, regions
+        self.positions = list(positions)
+
+
+    def get_kept_sides(self, width, height, candidates, with_tags, zones_index):
+        """ Get the previous sides that are still valid.
+
+        Arguments:
+        width -- width of the frame
+        height -- height of the frame
+        candidates -- numpy array (N, 4, 4) returned by get_candidate_positions
+        with_tags -- boolean numpy array (N,), True if the zone has tags
+        zones_index -- GridIndex with the zones
+
+        Return:
+        Dict from zone index to the index of its side in SIDES (only the kept ones)
+        """
+        ids = [i for i, side in self.sides.items() if side is not None and i < len(candidates) and with_tags[i]]
+        if not ids:
+            return {}
+        ids = np.array(sorted(ids))
+        sides = np.array([self.sides[i] for i in ids.tolist()])
+        rectangles = candidates[ids, sides]
+
+        kept = (rectangles[:, 0] >= 0) & (rectangles[:, 2] > rectangles[:, 0]) & \
+               (rectangles[:, 1] >= 0) & (rectangles[:, 3] > rectangles[:, 1]) & \
+               (rectangles[:, 2] <= width) & (rectangles[:, 3] <= height)
+        rectangle_ids, zone_ids = zones_index.query_pairs(rectangles)
+        kept[rectangle_ids[ids[rectangle_ids] != zone_ids]] = False
+
+        # If two tags overlap now, only the first one keeps its side
+        pairs_a, pairs_b = GridIndex(rectangles).query_pairs(rectangles)
+        kept[pairs_b[pairs_a < pairs_b]] = False
+        return dict(zip(ids[kept].tolist(), sides[kept].tolist()))
+
+
+def solve_tags_layout(width, height, candidates, with_tags, zones_index, fixed={}):
+    """ Auxiliar Method: Choose the side of the tags of each zone (check get_possible_positions).
+
+    Arguments:
+    width -- width of the frame
+    height -- height of the frame
+    candidates -- numpy array (N, 4, 4) returned by get_candidate_positions
+    with_tags -- boolean numpy array (N,), True if the zone has tags
+    zones_index -- GridIndex with the zones
+
+    Keyword arguments:
+    fixed -- dict from zone index to the index of its side, for the zones
+             whose side can't change (default {})
+
+    Return:
+    Dict from zone index to the index of its side in SIDES (only placed zones)
+    """
+    # Only the zones that are not fixed are placed, and only accepts tags
+    # inside the frame and not inside other selections
+    free = np.flatnonzero(with_tags)
+    if fixed:
+        free = free[~np.isin(free, list(fixed))]
+    free_candidates = candidates[free]
+    valid = (free_candidates[..., 0] >= 0) & (free_candidates[..., 2] > free_candidates[..., 0]) & \
+            (free_candidates[..., 1] >= 0) & (free_candidates[..., 3] > free_candidates[..., 1]) & \
+            (free_candidates[..., 2] <= width) & (free_candidates[..., 3] <= height)
+    # Region covered by all the sides of each free zone, only the zones over it are checked with each side
+    regions = get_candidates_region(free_candidates)
+    region_ids, zone_ids = zones_index.query_pairs(regions)
+    different = free[region_ids] != zone_ids
+    region_ids, zone_ids = region_ids[different], zone_ids[different]
+    a, b = free_candidates[region_ids], zones_index.rectangles[zone_ids][:, None, :]
+    collisions = (a[..., 0] <= b[..., 2]) & (b[..., 0] <= a[..., 2]) & (a[..., 1] <= b[..., 3]) & (b[..., 1] <= a[..., 3])
+    pairs, sides = np.nonzero(collisions)
+    valid[region_ids[pairs], sides] = False
+    placeable = valid.any(axis=1)
+    free, valid, regions = free[placeable], valid[placeable], regions[placeable]
+
+    # Tags that could collide with the tags of each free zone: the fixed ones
+    # over its region, and the free ones whose region overlaps it
+    fixed_ids = np.array(list(fixed), dtype=np.int64)
+    obstacle_ids = np.concatenate([free, fixed_ids])
+    obstacles = np.concatenate([regions, candidates[fixed_ids, [fixed[i] for i in fixed_ids.tolist()]].reshape(-1, 4)])
+    pairs_a, pairs_b = GridIndex(obstacles).query_pairs(regions)
+    different = free[pairs_a] != obstacle_ids[pairs_b]
+    neighbours = {i: [] for i in free.tolist()}
+    for i, j in zip(free[pairs_a[different]].tolist(), obstacle_ids[pairs_b[different]].tolist()):
+        neighbours[i].append(j)
+
+    # Each combination of valid sides (as bits) is one of the lists in _VALID_SIDES
+    valid_sides = dict(zip(free.tolist(), [_VALID_SIDES[bits] for bits in (valid @ _SIDE_BITS).tolist()]))
+    rectangles = dict(zip(obstacle_ids.tolist(), candidates[obstacle_ids].tolist()))
+    placed = dict(fixed)
+
+    def blockers(i, side):
+        rectangle = rectangles[i][side]
+        return [j for j in neighbours[i] if j in placed and overlap(rectangle, rectangles[j][placed[j]])]
+
+    # Greedy: the most constrained zones first, each one on its best free side
+    for i in free[np.argsort(valid.sum(axis=1), kind='stable')].tolist():
+        if not neighbours[i]:
+            placed[i] = valid_sides[i][0]
             continue
-        # Only accepts tags not collisioning with other tags
-        for j in range(i+1,len(all_selected_zones)):
-            if j not in conflict_zones:
-                problem.addConstraint(lambda zone_1, zone_2:
-                    not rectangle_collision_rectangle(zone_1[0], zone_2[0]), ('zone_{}'.format(i), 'zone_{}'.format(j))
-                )
-
-    best_solution = None
-    score = 0
-    solutions = problem.getSolutions()
-    for solution in solutions:
-        current_score = 0
-        for key in solution.keys():
-            position = solution[key][1]
-            info_zone = solution[key]
-            if position == 'bottom_right':
-                current_score += 4
-            elif position == 'bottom_left':
-                current_score += 3
-            elif position == 'inside':
-                current_score += 2
-            else:
-                current_score += 1
-        if current_score > score:
-            score = current_score
-            best_solution = solution
-
-    final_ans = []
-    if best_solution:
-        for i in range(len(all_selected_zones)):
-            zone_name = 'zone_{}'.format(i)
-            if zone_name not in best_solution:
-                final_ans.append(None)
-                continue
-            info_zone, position_name = best_solution[zone_name]
-            # This is for testing where this method thinks tags will be poisitionated
-            if len(frame):
-                cv2.rectangle(frame, (info_zone.x1,info_zone.y1),(info_zone.x2, info_zone.y2), (0,255,0),0)
-            if info_zone.x1 >= 0 and info_zone.x2 <= width and info_zone.y1 >= 0 and info_zone.y2 <= height:
-                final_ans.append(position_name)
-            else:
-                # If there is not a really good solution, just lets the method add_tags decide the position
-                final_ans.append(None)
+        for side in valid_sides[i]:
+            rectangle = rectangles[i][side]
+            # Stops at the first blocking tag
+            if not any(j in placed and overlap(rectangle, rectangles[j][placed[j]]) for j in neighbours[i]):
+                placed[i] = side
+                break
+        else:
+            # Local repair: move the only tag blocking one side to another free side
+            for side in valid_sides[i]:
+                blocking = blockers(i, side)
+                if len(blocking) != 1:
+                    continue
+                j = blocking[0]
+                if j in fixed:
+                    continue
+                for other_side in valid_sides[j]:
+                    if other_side != placed[j] and not overlap(rectangles[i][side], rectangles[j][other_side]) \
+                       and not blockers(j, other_side):
+                        placed[j] = other_side
+                        placed[i] = side
+                        break
+                if i in placed:
+                    break
+    return placed
+
+
+def get_possible_positions(width, height, all_selected_zones, all_tags_shapes, margin=5, frame=[], memory=None):
+    """ Choose where to put the tags of each selected zone, avoiding overlapped information.
+
+    Tags are never placed outside the frame or over other selected zones, and
+    tags of different zones never overlap each other. The zones with less valid
+    sides are placed first, each one on its best free side ('bottom_right',
+    'bottom_left', 'inside' and then 'top'). If a zone has no free side, we try
+    to move the only tag that blocks one of its sides to another free side.
+
+    With a TagsLayoutMemory, the zones whose previous side is still valid keep
+    it and only the other ones are placed.
+
+    Arguments:
+    width -- width of the frame
+    height -- height of the frame
+    all_selected_zones -- list of Rectangle objects or touples (x1, y1, x2, y2),
+                          or numpy array (N, 4)
+    all_tags_shapes -- list with the (width, height) of the tags of each zone,
+                       None if the zone has no tags
+
+    Keyword arguments:
+    margin -- extra margin in pixels to be separeted with the selected zone (default 5)
+    frame -- if provided, it draws where the tags will be (only for testing)
+    memory -- TagsLayoutMemory with the sides of the previous frame, it is
+              updated with the new ones (default None)
+
+    Return:
+    List with the side of each zone (one of SIDES), None if there is not a good
+    one (so add_tags will decide it)
+    """
+    n_zones = len(all_selected_zones)
+    final_ans = [None] * n_zones
+    if not n_zones:
+        return final_ans
+
+    # Pixels fit in int32, and checking collisions with numpy is faster than with int64
+    if isinstance(all_selected_zones, np.ndarray):
+        zones = all_selected_zones.astype(np.int32, copy=False).reshape(-1, 4)
+    else:
+        zones = np.array([(zone.x1, zone.y1, zone.x2, zone.y2) if isinstance(zone, Rectangle) else zone[:4]
+                          for zone in all_selected_zones], dtype=np.int32).reshape(-1, 4)
+    with_tags = np.array([shape is not None for shape in all_tags_shapes] + [False] * (n_zones - len(all_tags_shapes)))
+    shapes = np.array([shape if shape is not None else (0, 0) for shape in all_tags_shapes] +
+                      [(0, 0)] * (n_zones - len(all_tags_shapes)), dtype=np.int32).reshape(-1, 2)
+    layout = (width, height, margin)
+    if memory is not None and not len(frame) and memory.is_unchanged(layout, zones, shapes, with_tags):
+        return list(memory.positions)
+
+    candidates = get_candidate_positions(zones, shapes, margin=margin)
+    zones_index = GridIndex(zones)
+    if memory is None:
+        placed = solve_tags_layout(width, height, candidates, with_tags, zones_index)
+    else:
+        # Region covered by each zone and all the sides of its tags
+        regions = get_candidates_region(candidates)
+        np.minimum(regions[:, :2], zones[:, :2], out=regions[:, :2])
+        np.maximum(regions[:, 2:], zones[:, 2:], out=regions[:, 2:])
+        placed = memory.get_kept_sides(width, height, candidates, with_tags, zones_index)
+        to_place = memory.get_zones_to_place(layout, regions, with_tags, placed)
+        if to_place.any():
+            placed = solve_tags_layout(width, height, candidates, to_place, zones_index, fixed=placed)
+
+    for i, side in placed.items():
+        final_ans[i] = SIDES[side]
+        # This is for testing where this method thinks tags will be poisitionated
+        if len(frame):
+            x1, y1, x2, y2 = candidates[i, side].tolist()
+            cv2.rectangle(frame, (x1, y1), (x2, y2), (0,255,0), 0)
+    if memory is not None:
+        memory.update(layout, zones, shapes, with_tags, regions, placed, final_ans)
     return final_ans
 
+
 if __name__ == '__main__':
     width = 1280
     height = 720
@@ -17,9 +17,6 @@ setuptools.setup(
     install_requires=[
         #'opencv-python',
         'numpy',
-        'python-constraint',
-        #'pillow',
-        'imagehash'
     ],
     classifiers=[
         'Programming Language :: Python :: 3',
@@ -0,0 +1,249 @@
+import cv2
+import numpy as np
+import unittest
+from unittest import mock
+
+from cv2_tools.Utils import (TAG_SPRITES, Rectangle, adjust_position, adjust_positions, blend_primitives,
+                             blit_tag_sprite, get_shape_tags, get_tag_sprite, get_tags_layout, get_text_metrics)
+from cv2_tools.Composition import CompositorCV2
+from cv2_tools.Selection import SelectorCV2
+
+
+def full_frame_blend(frame, primitives, alpha):
+    """ Reference implementation: draw over a copy of the whole frame and blend it"""
+    overlay = frame.copy()
+    for primitive in primitives:
+        if primitive[0] == 'contour':
+            cv2.drawContours(overlay, [np.array(primitive[1])], 0, primitive[2], -1)
+        elif primitive[0] == 'line':
+            cv2.line(overlay, *primitive[1:])
+        else:
+            cv2.rectangle(overlay, *primitive[1:])
+    cv2.addWeighted(overlay, alpha, frame, 1 - alpha, 0, frame)
+    return frame
+
+
+class TestBlendPrimitives(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = np.random.RandomState(0).randint(0, 256, (240, 320, 3), dtype=np.uint8)
+
+    def assertSameBlend(self, primitives, alpha):
+        expected = full_frame_blend(self.frame.copy(), primitives, alpha)
+        result = blend_primitives(self.frame.copy(), primitives, alpha)
+        self.assertTrue(np.array_equal(expected, result), 'ROI blending should be pixel-identical')
+
+    def test_rectangles(self):
+        for thickness in (1, 2, 5, cv2.FILLED):
+            self.assertSameBlend([('rectangle', (30, 40), (120, 200), (110,70,45), thickness)], 0.9)
+
+    def test_lines_and_contours(self):
+        primitives = [
+            ('line', (10, 10), (10, 30), (0,0,255), 3),
+            ('line', (100, 120), (60, 120), (0,255,0), 1),
+            ('contour', [(200, 50), (200, 70), (190, 60)], (20,20,20)),
+        ]
+        self.assertSameBlend(primitives, 0.75)
+
+    def test_outside_frame(self):
+        self.assertSameBlend([('rectangle', (-20, -10), (15, 500), (255,255,255), 2)], 0.3)
+        self.assertSameBlend([('rectangle', (400, 300), (500, 400), (255,255,255), -1)], 0.3)
+
+
+class TestCompositor(unittest.TestCase):
+
+    def test_same_as_blending_separately(self):
+        frame = np.random.RandomState(1).randint(0, 256, (240, 320, 3), dtype=np.uint8)
+        # Primitives that do not overlap each other, with different alphas
+        elements = [
+            ([('rectangle', (10, 10), (60, 80), (110,70,45), 2)], 0.9),
+            ([('rectangle', (15, 15), (55, 75), (110,70,45), -1)], 0.3),
+            ([('contour', [(70, 20), (70, 30), (64, 25)], (20,20,20))], 0.75),
+            ([('rectangle', (200, 100), (300, 230), (0,0,255), 3)], 0.9),
+        ]
+        font_info = (cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1)
+
+        expected = frame.copy()
+        compositor = CompositorCV2()
+        for primitives, alpha in elements:
+            expected = blend_primitives(expected, primitives, alpha)
+            compositor.add_primitives(primitives, alpha)
+        cv2.putText(expected, 'person', (80, 40), *font_info)
+        compositor.add_text('person', (80, 40), font_info)
+
+        result = compositor.compose(frame.copy())
+        self.assertTrue(np.array_equal(expected, result), 'Compositor should blend each element once')
+        self.assertFalse(compositor.groups or compositor.texts, 'Compositor should be empty after compose')
+
+    def test_one_blend_per_alpha(self):
+        frame = np.random.RandomState(2).randint(0, 256, (480, 640, 3), dtype=np.uint8)
+        # Small zones far from each other (and some of them out of the frame)
+        expected = frame.copy()
+        compositor = CompositorCV2()
+        for x in range(-20, 640, 100):
+            for y in range(-20, 480, 100):
+                for primitives, alpha in (([('rectangle', (x, y), (x+30, y+40), (110,70,45), 2)], 0.9),
+                                          ([('rectangle', (x+5, y+5), (x+25, y+35), (110,70,45), -1)], 0.3),
+                                          ([('line', (x+10, y+20), (x+20, y+20), (0,0,255), 1)], 0.75)):
+                    expected = blend_primitives(expected, primitives, alpha)
+                    compositor.add_primitives(primitives, alpha)
+
+        result = compositor.compose(frame.copy())
+        self.assertEqual(compositor.blends, 3, 'Compositor should blend each alpha group once')
+        self.assertTrue(np.array_equal(expected, result), 'Compositor should blend each element once')
+
+
+class TestTextMetrics(unittest.TestCase):
+
+    def test_cache(self):
+        font_info = (cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1)
+        get_text_metrics.cache_clear()
+        shape = get_shape_tags(['person 0.93', 'id 4\nzone A'], font_info)
+        self.assertEqual(get_shape_tags(['person 0.93', 'id 4\nzone A'], font_info), shape)
+
+        info = get_text_metrics.cache_info()
+        self.assertEqual((info.hits, info.misses), (1, 1))
+
+        lines, text_width, text_height = get_text_metrics(('person 0.93', 'id 4\nzone A'), *font_info[:2], 1)
+        self.assertEqual(lines, ('person 0.93', 'id 4', 'zone A\n'))
+        self.assertEqual(text_width, cv2.getTextSize('person 0.93', *font_info[:2], 1)[0][0])
+
+
+class TestTagSprites(unittest.TestCase):
+
+    def test_same_as_drawing(self):
+        frame = np.random.RandomState(3).randint(0, 256, (240, 320, 3), dtype=np.uint8)
+        # The default font, and fonts whose antialiased glyphs overlap
+        for font_info in ((cv2.FONT_HERSHEY_COMPLEX_SMALL, 0.75, (255,255,255), 1),
+                          (cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0,200,90), 1),
+                          (cv2.FONT_HERSHEY_PLAIN, 0.75, (255,255,255), 3)):
+            self.assertSameAsDrawing(frame, font_info)
+
+    def assertSameAsDrawing(self, frame, font_info):
+        lines, text_width, text_height = get_text_metrics(('person 0.93', 'id 4\nzone A'), font_info[0],
+                                                          font_info[1], font_info[3])
+
+        # Inside the frame and clipped by its borders
+        for anchor in ((40, 120), (-30, 20), (280, 230)):
+            for inside in (False, True):
+                backgrounds, texts = get_tags_layout(lines, text_width, text_height, inside)
+                expected = blend_primitives(frame.copy(), [('rectangle', (pt1[0] + anchor[0], pt1[1] + anchor[1]),
+                    (pt2[0] + anchor[0], pt2[1] + anchor[1]), (20,20,20), -1) for pt1, pt2 in backgrounds], 0.75)
+                for text, (x, y) in texts:
+                    cv2.putText(expected, text, (x + anchor[0], y + anchor[1]), *font_info)
+
+                sprite = get_tag_sprite(lines, text_width, text_height, inside, (20,20,20), font_info)
+                result = blit_tag_sprite(frame.copy(), sprite, anchor, 0.75)
+                self.assertTrue(np.array_equal(expected, result), 'Sprites should be pixel-identical')
+
+    def test_cache(self):
+        font_info = (cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,255), 1)
+        TAG_SPRITES.clear()
+        sprite = get_tag_sprite(('speed 3',), 50, 12, False, (20,20,20), font_info)
+        self.assertIs(get_tag_sprite(('speed 3',), 50, 12, False, (20,20,20), font_info), sprite)
+        self.assertEqual((TAG_SPRITES.hits, TAG_SPRITES.misses, len(TAG_SPRITES)), (1, 1, 1))
+        self.assertEqual(TAG_SPRITES.current_bytes, sprite[0].nbytes + sprite[1].nbytes)
+
+
+class TestAdjustPositions(unittest.TestCase):
+
+    def test_same_as_adjust_position(self):
+        random = np.random.RandomState(4)
+        for normalized, positions in ((True, random.uniform(-0.2, 1.2, (200, 4))),
+                                      (False, random.randint(-50, 400, (200, 4)))):
+            for thickness in (0, 2, 5):
+                expected = []
+                for x1, y1, x2, y2 in positions.tolist():
+                    position = adjust_position((240, 320), Rectangle(x1, y1, x2, y2), normalized=normalized, thickness=thickness)
+                    expected.append([position.x1, position.y1, position.x2, position.y2])
+
+                with mock.patch('cv2_tools.Utils.eprint') as eprint:
+                    result = adjust_positions((240, 320), positions, normalized=normalized, thickness=thickness)
+                self.assertEqual(result.tolist(), expected)
+                # Only one warning with the number of values out of the frame
+                limits = (1, 1, 1, 1) if normalized else (320, 240, 320, 240)
+                out_of_bounds = int(((positions < 0) | (positions > limits)).sum())
+                eprint.assert_called_once()
+                self.assertTrue(eprint.call_args[0][0].startswith('Warning: {} values'.format(out_of_bounds)))
+
+
+    def test_out_of_bounds(self):
+        # Inside, partly out (2 values) and fully out (4 values) of the frame
+        positions = [(10, 10, 100, 100), (-20, 50, 400, 100), (-50, -60, -10, -5)]
+        with mock.patch('cv2_tools.Utils.eprint'):
+            result, out_of_bounds = adjust_positions((240, 320), positions, return_out_of_bounds=True)
+            self.assertEqual(out_of_bounds, 6)
+            self.assertEqual(result.tolist(), adjust_positions((240, 320), positions).tolist())
+            self.assertEqual(adjust_positions((240, 320), [(0.1, 0.1, 0.5, 0.5), (0.5, 0.5, 1.5, 1.2)], normalized=True,
+                                              return_out_of_bounds=True)[1], 2)
+            self.assertEqual(adjust_positions((240, 320), positions[:1], return_out_of_bounds=True)[1], 0)
+
+
+class TestSelectorDraw(unittest.TestCase):
+
+    def setUp(self):
+        self.frame = np.random.RandomState(2).randint(0, 256, (240, 320, 3), dtype=np.uint8)
+        self.selector = SelectorCV2(filled=True)
+        self.selector.add_zone((20, 30, 120, 160), tags=['person 0.93'])
+        self.expected = self.selector.draw(self.frame)
+
+    def test_coordinates(self):
+        self.selector.add_zone((200, 30, 300, 160), tags=['car'])
+        # Only the tags of the second zone are drawed
+        selector = SelectorCV2(filled=True)
+        selector.add_zone((20, 30, 120, 160))
+        selector.add_zone((200, 30, 300, 160), tags=['car'])
+        expected = selector.draw(self.frame)
+        self.assertTrue(np.array_equal(expected, self.selector.draw(self.frame, coordinates=(250, 100))))
+
+    def test_zones_index(self):
+        zone = [200, 30, 300, 160]
+        self.selector.add_zone(zone, tags=['car'])
+        self.assertEqual(list(self.selector.get_zones_index().query_point(250, 100)), [1])
+
+        # Changing the given zone doesn't change the selector
+        zone[0] = 260
+        self.assertEqual(list(self.selector.get_zones_index().query_point(250, 100)), [1])
+
+        # Moving the zones updates the index
+        self.selector.set_zone(1, (20, 170, 120, 230))
+        self.selector.set_zone(0, (210, 40, 290, 150))
+        self.assertEqual(list(self.selector.get_zones_index().query_point(250, 100)), [0])
+        self.assertEqual(list(self.selector.get_zones_index().query_point(50, 200)), [1])
+
+        self.selector.set_range_valid_rectangles(1, 2)
+        self.assertEqual(list(self.selector.get_zones_index().query_point(250, 100)), [])
+        self.assertEqual(list(self.selector.get_zones_index().query_point(50, 200)), [0])
+
+    def test_in_place(self):
+        frame = self.frame.copy()
+        result = self.selector.draw(frame, in_place=True)
+        self.assertIs(result, frame)
+        self.assertTrue(np.array_equal(self.expected, result))
+
+    def test_out(self):
+        out = np.empty_like(self.frame)
+        result = self.selector.draw(self.frame, out=out)
+        self.assertIs(result, out)
+        self.assertTrue(np.array_equal(self.expected, out))
+
+        out = np.empty((120, 160, 3), dtype=np.uint8)
+        result = self.selector.draw(self.frame, out=out, fx=0.5, fy=0.5)
+        self.assertIs(result, out)
+
+        with self.assertRaises(ValueError):
+            self.selector.draw(self.frame, out=out)
+
+    def test_other_channels(self):
+        # Grayscale and BGRA frames can't use the BGR tag sprites
+        gray = self.selector.draw(self.frame[:, :, 0].copy())
+        self.assertEqual(gray.shape, self.frame.shape[:2])
+        self.assertTrue(np.array_equal(self.expected[:, :, 0], gray))
+
+        bgra = self.selector.draw(cv2.cvtColor(self.frame, cv2.COLOR_BGR2BGRA))
+        self.assertEqual(bgra.shape, self.frame.shape[:2] + (4,))
+        self.assertTrue(np.array_equal(self.expected, bgra[:, :, :3]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import os
+import subprocess
+import sys
+import unittest
+
+# Seconds that importing cv2_tools can take (without cv2 and numpy)
+IMPORT_TIME_BUDGET = 0.5
+
+SCRIPT = '''
+import sys, time
+import cv2, numpy
+start = time.perf_counter()
+import cv2_tools, cv2_tools.Management, cv2_tools.Selection, cv2_tools.Storage
+print(time.perf_counter() - start)
+print(','.join(module for module in ('PIL', 'imagehash', 'dlib', 'constraint') if module in sys.modules))
+'''
+
+
+class TestImports(unittest.TestCase):
+
+    def test_import_time(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join([root, os.environ.get('PYTHONPATH', '')]))
+        output = subprocess.run([sys.executable, '-c', SCRIPT], cwd=root, env=env,
+                                stdout=subprocess.PIPE, check=True, universal_newlines=True).stdout.split('\n')
+
+        self.assertLess(float(output[0]), IMPORT_TIME_BUDGET, 'Importing cv2_tools should be fast')
+        self.assertEqual(output[1], '', 'Optional backends should be imported only when needed')
+
+    def test_complete_help(self):
+        import cv2_tools
+        self.assertIn('select_zone', cv2_tools.complete_help)
+        with self.assertRaises(AttributeError):
+            cv2_tools.not_an_attribute
+
+
+if __name__ == "__main__":
+    unittest.main()
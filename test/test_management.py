@@ -0,0 +1,418 @@
+import asyncio
+import cv2
+import importlib.util
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from cv2_tools.Management import ChunkedManagerCV2, ManagerCV2, MultiManagerCV2
+from cv2_tools.Selection import SelectorCV2
+
+
+def write_video(path, n_frames=40, shape=(48, 64), fps=25):
+    """ Write a small video where the frame i is filled with the value i*5"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), fps, shape[::-1])
+    for i in range(n_frames):
+        writer.write(np.full(shape + (3,), i*5, dtype=np.uint8))
+    writer.release()
+
+
+class SlowVideo():
+    """ Video that takes `delay` seconds to read each frame"""
+
+    def __init__(self, delay, n_frames=10):
+        self.delay = delay
+        self.n_frames = n_frames
+
+    def read(self, image=None):
+        time.sleep(self.delay)
+        self.n_frames -= 1
+        return self.n_frames >= 0, np.zeros((4, 4, 3), dtype=np.uint8)
+
+    def get(self, prop_id):
+        return 0
+
+    def release(self):
+        pass
+
+
+class BrokenVideo(SlowVideo):
+    """ Video that raises an exception after reading `n_frames` frames"""
+
+    def read(self, image=None):
+        if self.n_frames <= 0:
+            raise IOError('Broken video')
+        return super().read(image)
+
+
+def frame_value(frame):
+    """ Index of a frame written by write_video"""
+    return int(round(frame.mean() / 5))
+
+
+class TestManager(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.directory, 'video.avi')
+        write_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_all_frames(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=4)
+        self.assertEqual([frame_value(frame) for frame in manager], list(range(40)))
+        self.assertEqual(manager.count_frames, 40)
+
+    def test_reuse_frames(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=4, reuse_frames=True)
+        leased = None
+        values = []
+        for frame in manager:
+            values.append(frame_value(frame))
+            if manager.count_frames == 10:
+                leased = manager.lease_frame()
+
+        self.assertEqual(values, list(range(40)))
+        # The leased frame was not reused, and the rest of buffers were
+        self.assertEqual(frame_value(leased), 9)
+        self.assertLessEqual(manager.frame_pool.allocations, 4 + 4)
+        self.assertGreater(manager.frame_pool.reuses, 30)
+
+    def test_queue_bytes(self):
+        frame_bytes = 48 * 64 * 3
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_bytes=3 * frame_bytes)
+        occupancies = []
+        for frame in manager:
+            time.sleep(0.002)
+            occupancies.append(manager.get_queue_occupancy())
+
+        self.assertEqual(manager.count_frames, 40)
+        self.assertEqual(occupancies[-1]['max_depth'], 3)
+        self.assertTrue(all(occupancy['bytes'] <= 3 * frame_bytes for occupancy in occupancies[:-1]))
+
+    def test_adaptive_queue(self):
+        seconds = ManagerCV2._adaptive_queue_seconds
+        ManagerCV2._adaptive_queue_seconds = 0.05
+        try:
+            manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=32, adaptive_queue=True)
+            for frame in manager:
+                # Less than 50 FPS, so it only needs 3 frames
+                time.sleep(0.02)
+                if manager.count_frames > 5:
+                    self.assertLessEqual(manager.get_queue_occupancy()['depth'], 3)
+            self.assertEqual(manager.count_frames, 40)
+        finally:
+            ManagerCV2._adaptive_queue_seconds = seconds
+
+    def test_latest_frame(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), latest_frame=True)
+        values = []
+        for frame in manager:
+            values.append(frame_value(frame))
+            time.sleep(0.01)
+
+        # Each frame is consumed or dropped, and always in order
+        self.assertEqual(len(values) + manager.dropped_frames, 40)
+        self.assertEqual(values, sorted(set(values)))
+        self.assertEqual(values[-1], 39)
+        self.assertGreaterEqual(manager.get_latency(), 0)
+
+    def test_stride(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), stride=5)
+        frames = [(frame_value(frame),) + manager.get_frame_info() for frame in manager]
+        self.assertEqual([(value, index) for value, index, _ in frames], [(i, i) for i in range(0, 40, 5)])
+        self.assertEqual([round(timestamp, 3) for _, _, timestamp in frames], [i / 25 for i in range(0, 40, 5)])
+
+        # 25 FPS to 10 FPS
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), target_fps=10)
+        self.assertEqual([frame_value(frame) for frame in manager], [int(np.ceil(i * 2.5)) for i in range(16)])
+
+    def test_detect_scenes(self):
+        # Two scenes of 20 frames, with some noise
+        random = np.random.RandomState(0)
+        scenes = [cv2.resize(random.randint(0, 256, (6, 8, 3), dtype=np.uint8), (64, 48)) for _ in range(2)]
+        path = os.path.join(self.directory, 'scenes.avi')
+        writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (64, 48))
+        for i in range(40):
+            writer.write(np.clip(scenes[i // 20] + random.randint(-6, 7, (48, 64, 3)), 0, 255).astype(np.uint8))
+        writer.release()
+
+        for scene_threshold in (25, None):
+            manager = ManagerCV2(cv2.VideoCapture(path), detect_scenes=True, scene_threshold=scene_threshold)
+            scores = [(manager.new_scene, manager.scene_score) for frame in manager]
+            self.assertEqual([i for i, (new_scene, _) in enumerate(scores) if new_scene], [0, 20])
+            self.assertGreater(scores[20][1], 25)
+            self.assertLess(max(score for i, (_, score) in enumerate(scores) if i not in (0, 20)), 5)
+
+    def test_map(self):
+        def slow_value(frame):
+            # The first frames are the slowest ones, so they finish in a different order
+            value = frame_value(frame)
+            time.sleep(0.002 * (40 - value) % 0.03)
+            return value
+
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=4, reuse_frames=True)
+        results = list(manager.map(slow_value, workers=4))
+        self.assertEqual([(index, result) for index, _, result in results], [(i, i) for i in range(40)])
+        self.assertEqual([timestamp for _, timestamp, _ in results], sorted(timestamp for _, timestamp, _ in results))
+        self.assertEqual(manager.count_frames, 40)
+        self.assertFalse(manager.queue_thread.is_alive())
+
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=2)
+        for index, timestamp, result in manager.map(frame_value):
+            break
+        self.assertFalse(manager.queue_thread.is_alive())
+
+    def test_map_processes(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=4)
+        results = list(manager.map(frame_value, workers=2, processes=True))
+        self.assertEqual([(index, result) for index, _, result in results], [(i, i) for i in range(40)])
+        self.assertIsNone(manager.shared_frames)
+        self.assertFalse(manager.queue_thread.is_alive())
+
+    def test_async(self):
+        async def consume(manager):
+            return [frame_value(frame) async for frame in manager]
+
+        async def main():
+            managers = [ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=2) for _ in range(3)]
+            return await asyncio.gather(*(consume(manager) for manager in managers))
+
+        self.assertEqual(asyncio.run(main()), [list(range(40))] * 3)
+
+    def test_async_timeout_and_cancel(self):
+        async def consume(manager):
+            async for frame in manager:
+                pass
+
+        async def main():
+            manager = ManagerCV2(SlowVideo(0.5), frame_timeout=0.05)
+            with self.assertRaises(asyncio.TimeoutError):
+                await consume(manager)
+            await manager.astop()
+            self.assertFalse(manager.queue_thread.is_alive())
+
+            # After a timeout, the same reader continues
+            manager = ManagerCV2(SlowVideo(0.1), frame_timeout=0.02)
+            with self.assertRaises(asyncio.TimeoutError):
+                await consume(manager)
+            queue_thread = manager.queue_thread
+            manager.frame_timeout = None
+            frames = [frame async for frame in manager]
+            self.assertIs(manager.queue_thread, queue_thread)
+            self.assertEqual(len(frames), 10)
+
+            manager = ManagerCV2(SlowVideo(0.05))
+            task = asyncio.ensure_future(consume(manager))
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            self.assertTrue(manager.stopped)
+            await manager.astop()
+
+        asyncio.run(main())
+
+    def test_reader_error(self):
+        manager = ManagerCV2(BrokenVideo(0, n_frames=3))
+        frames = []
+        with self.assertRaises(IOError):
+            for frame in manager:
+                frames.append(frame)
+        # The queued frames are returned before the exception
+        self.assertEqual(len(frames), 3)
+        self.assertFalse(manager.queue_thread.is_alive())
+
+        async def consume(manager):
+            return [frame async for frame in manager]
+
+        with self.assertRaises(IOError):
+            asyncio.run(consume(ManagerCV2(BrokenVideo(0.01, n_frames=3))))
+
+    def test_keystrokes(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), fps_limit=100)
+        for keystroke in range(8):
+            manager.add_keystroke(ord('a') + keystroke, 1, 'key_{}'.format(keystroke))
+        manager.add_keystroke(27, 5, exit=True)
+
+        # Only one wait for each frame, with the time until the next one (10 ms)
+        keys = iter([-1, ord('c'), -1, ord('c'), ord('b'), 27])
+        with mock.patch('cv2.waitKey', side_effect=lambda delay: next(keys)) as wait_key:
+            frames = sum(1 for frame in manager)
+        self.assertEqual(frames, 5)
+        self.assertEqual(wait_key.call_count, 6)
+        self.assertTrue(all(5 <= call[0][0] <= 10 for call in wait_key.call_args_list))
+        self.assertEqual((manager.key_manager.key_2, manager.key_manager.key_1), (False, True))
+
+    def test_stop(self):
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path), queue_size=2)
+        for frame in manager:
+            break
+        self.assertFalse(manager.queue_thread.daemon)
+        manager.stop()
+        self.assertFalse(manager.queue_thread.is_alive())
+
+    def test_exit_without_stop(self):
+        # The reader thread is waiting for space in the queue when the program finishes
+        script = 'import cv2\nfrom cv2_tools.Management import ManagerCV2\n' \
+                 'for frame in ManagerCV2(cv2.VideoCapture({!r}), queue_size=2):\n    break\n'.format(self.video_path)
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        subprocess.run([sys.executable, '-c', script], cwd=root, timeout=30, check=True)
+
+
+
+class TestMultiManager(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.directory, 'video.avi')
+        cls.half_video_path = os.path.join(cls.directory, 'half_video.avi')
+        write_video(cls.video_path)
+        # Same duration, but half of the frames
+        write_video(cls.half_video_path, n_frames=20, fps=12.5)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_turns(self):
+        frame_bytes = 48 * 64 * 3
+        videos = {source_id: cv2.VideoCapture(self.video_path) for source_id in 'abc'}
+        manager = MultiManagerCV2(videos, workers=2, queue_bytes=4 * frame_bytes)
+        frames = []
+        for source_id, frame in manager:
+            frames.append((source_id, frame_value(frame)))
+            # Each video can always keep two frames
+            self.assertLessEqual(manager.get_queue_occupancy()['bytes'], 6 * frame_bytes)
+
+        # Each video in order, and none of them goes far ahead of the others
+        for source_id in 'abc':
+            self.assertEqual([value for frame_id, value in frames if frame_id == source_id], list(range(40)))
+        for i in range(len(frames)):
+            counts = [sum(frame_id == source_id for frame_id, _ in frames[:i]) for source_id in 'abc']
+            self.assertLessEqual(max(counts) - min(counts), manager.queue_size)
+        self.assertFalse(any(thread.is_alive() for thread in manager.threads))
+
+    def test_iterate_again(self):
+        manager = MultiManagerCV2([cv2.VideoCapture(self.video_path), cv2.VideoCapture(self.half_video_path)])
+        frames = []
+        for source_id, frame in manager:
+            frames.append(source_id)
+            if len(frames) == 10:
+                break
+        threads = manager.threads
+
+        # The same decode threads continue with the next frames
+        frames += [source_id for source_id, frame in manager]
+        self.assertEqual(manager.threads, threads)
+        self.assertEqual((frames.count(0), frames.count(1)), (40, 20))
+
+    def test_sync(self):
+        manager = MultiManagerCV2([cv2.VideoCapture(self.video_path), cv2.VideoCapture(self.half_video_path)],
+                                  sync=True, sync_tolerance=0.001)
+        frames = [(source_id, frame_value(frame)) for source_id, frame in manager]
+        self.assertEqual(frames[:40], [pair for i in range(20) for pair in ((0, 2*i), (1, i))])
+        self.assertEqual(manager.dropped_frames + len(frames), 60)
+
+
+def chunk_values(frames):
+    """ Indexes and values of the frames of a chunk"""
+    return [(index, frame_value(frame)) for index, _, frame in frames]
+
+
+class TestChunkedManager(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.directory, 'video.avi')
+        write_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_frames(self):
+        manager = ChunkedManagerCV2(self.video_path, chunks=3, queue_size=4)
+        self.assertEqual(manager.get_ranges(), [(0, 13), (13, 27), (27, 40)])
+        frames = [(frame_value(frame),) + manager.get_frame_info() for frame in manager]
+        self.assertEqual([(value, index) for value, index, _ in frames], [(i, i) for i in range(40)])
+        self.assertEqual(round(frames[30][2], 3), 30 / 25)
+        self.assertFalse(any(thread.is_alive() for thread in manager.threads))
+
+    def test_map(self):
+        manager = ChunkedManagerCV2(self.video_path, chunks=3)
+        for processes in (False, True):
+            results = [(index, result) for index, _, result in manager.map(frame_value, workers=2, processes=processes)]
+            self.assertEqual(results, [(i, i) for i in range(40)])
+
+        chunks = list(manager.map_chunks(chunk_values, chunks=4))
+        self.assertEqual(len(chunks), 4)
+        self.assertEqual([value for chunk in chunks for value in chunk], [(i, i) for i in range(40)])
+
+
+@unittest.skipUnless(importlib.util.find_spec('dlib'), 'dlib is needed to track objects')
+class TestTracking(unittest.TestCase):
+
+    def test_scale_and_workers(self):
+        # Three squares moving 2 pixels to the right in each frame
+        def get_frame(i):
+            frame = np.zeros((240, 320, 3), dtype=np.uint8)
+            for x, y in ((20, 20), (20, 140), (160, 80)):
+                cv2.rectangle(frame, (x + 2*i, y), (x + 2*i + 40, y + 40), (40, 200, 250), -1)
+            return frame
+
+        for scale, workers in ((1, 1), (0.5, 3)):
+            selector = SelectorCV2()
+            for x, y in ((20, 20), (20, 140), (160, 80)):
+                selector.add_zone((x, y, x + 40, y + 40))
+            manager = ManagerCV2(None)
+            manager.set_tracking(selector, get_frame(0), scale=scale, workers=workers)
+            for i in range(1, 11):
+                selector = manager.get_tracking(get_frame(i))
+
+            for (x, y), zone in zip(((40, 20), (40, 140), (180, 80)), selector.zones):
+                self.assertTrue(np.allclose(zone, (x, y, x + 40, y + 40), atol=4), zone)
+            self.assertEqual(len(manager.get_tracking_times()), 3)
+
+    def test_detect_and_track(self):
+        directory = tempfile.mkdtemp()
+        try:
+            # A square moving 2 pixels to the right in each frame
+            path = os.path.join(directory, 'square.avi')
+            writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, (320, 240))
+            for i in range(40):
+                frame = np.zeros((240, 320, 3), dtype=np.uint8)
+                cv2.rectangle(frame, (20 + 2*i, 100), (60 + 2*i, 140), (40, 200, 250), -1)
+                writer.write(frame)
+            writer.release()
+
+            def detector(frame):
+                x, y, width, height = cv2.boundingRect(cv2.findNonZero(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)))
+                selector = SelectorCV2()
+                selector.add_zone((x, y, x + width, y + height))
+                return selector
+
+            for kwargs in ({'every': 10}, {'every': 1, 'asynchronous': True}):
+                manager = ManagerCV2(cv2.VideoCapture(path))
+                zones = [(manager.count_frames, selector.zones[0]) for frame, selector in manager.detect_and_track(detector, **kwargs)]
+                self.assertEqual(len(zones), 40)
+                for count, zone in zones:
+                    x = 20 + 2*(count - 1)
+                    self.assertTrue(np.allclose(zone, (x, 100, x + 40, 140), atol=5), zone)
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    unittest.main()
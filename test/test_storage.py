@@ -0,0 +1,100 @@
+import cv2
+import numpy as np
+import os
+import shutil
+import tempfile
+import unittest
+
+from cv2_tools.Management import ManagerCV2, read_chunk
+from cv2_tools.Storage import SceneIndexCV2
+
+
+def write_scenes_video(path, n_scenes=3, scene_frames=60, shape=(48, 64), seed=0):
+    """ Write a video with scenes of `scene_frames` frames, each one with a different random pattern"""
+    random = np.random.RandomState(seed)
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 25, shape[::-1])
+    for scene in range(n_scenes):
+        pattern = cv2.resize(random.randint(0, 256, (6, 8, 3), dtype=np.uint8), shape[::-1])
+        for i in range(scene_frames):
+            writer.write(np.clip(pattern + random.randint(-4, 5, pattern.shape), 0, 255).astype(np.uint8))
+    writer.release()
+
+
+class TestSceneIndex(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.video_path = os.path.join(cls.directory, 'video.avi')
+        write_scenes_video(cls.video_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.directory)
+
+    def test_build_and_load(self):
+        scene_index = SceneIndexCV2.build(self.video_path)
+        self.assertEqual(scene_index.frames, [0, 60, 120])
+        self.assertEqual([round(timestamp, 3) for timestamp in scene_index.timestamps], [0, 2.4, 4.8])
+        self.assertEqual(scene_index.find_scene(100), 1)
+
+        loaded = SceneIndexCV2.load_or_build(self.video_path)
+        self.assertTrue(os.path.exists(SceneIndexCV2.get_index_path(self.video_path)))
+        self.assertEqual((loaded.frames, loaded.hashes, loaded.scores, loaded.video),
+                         (scene_index.frames, scene_index.hashes, scene_index.scores, scene_index.video))
+
+    def test_rebuild(self):
+        directory = tempfile.mkdtemp()
+        try:
+            video_path = os.path.join(directory, 'video.avi')
+            write_scenes_video(video_path)
+            scene_index = SceneIndexCV2.load_or_build(video_path)
+            self.assertEqual(scene_index.video['frame_count'], 180)
+
+            # Another video with the same name, the old index is not valid
+            write_scenes_video(video_path, n_scenes=2)
+            scene_index = SceneIndexCV2.load_or_build(video_path)
+            self.assertEqual((scene_index.video['frame_count'], scene_index.frames), (120, [0, 60]))
+            self.assertEqual(SceneIndexCV2(SceneIndexCV2.get_index_path(video_path)).video['frame_count'], 120)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_rebuild_same_length(self):
+        directory = tempfile.mkdtemp()
+        try:
+            video_path = os.path.join(directory, 'video.avi')
+            write_scenes_video(video_path)
+            scene_index = SceneIndexCV2.load_or_build(video_path)
+            self.assertEqual(scene_index.frames, [0, 60, 120])
+            stat = os.stat(video_path)
+            self.assertEqual((scene_index.video['size'], scene_index.video['mtime_ns']),
+                             (stat.st_size, stat.st_mtime_ns))
+
+            # Another video with the same name, frame_count and fps (its modification time
+            # is moved forward, the file system could be not precise enough to change it)
+            write_scenes_video(video_path, n_scenes=2, scene_frames=90, seed=1)
+            os.utime(video_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+            scene_index = SceneIndexCV2.load_or_build(video_path)
+            self.assertEqual((scene_index.video['frame_count'], scene_index.frames), (180, [0, 90]))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_seek_and_keyframes(self):
+        scene_index = SceneIndexCV2.load_or_build(self.video_path)
+        frames = {index: frame for index, _, frame in read_chunk(self.video_path)}
+
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path))
+        manager.seek_scene(scene_index, -1)
+        indexes = [manager.get_frame_info()[0] for frame in manager]
+        self.assertEqual(indexes, list(range(120, 180)))
+
+        manager = ManagerCV2(cv2.VideoCapture(self.video_path))
+        manager.set_keyframes(scene_index)
+        keyframes = [(manager.get_frame_info()[0], frame.copy()) for frame in manager]
+        self.assertEqual([index for index, _ in keyframes], [0, 60, 120])
+        for index, frame in keyframes:
+            self.assertTrue(np.array_equal(frame, frames[index]))
+
+
+if __name__ == "__main__":
+    unittest.main()
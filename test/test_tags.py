@@ -0,0 +1,138 @@
+import numpy as np
+import time
+import unittest
+from unittest import mock
+
+from cv2_tools.tags_constraint import (SIDES, GridIndex, TagsLayoutMemory, get_candidate_positions,
+                                      get_possible_positions, overlap, solve_tags_layout)
+
+
+def random_zones(n_zones, seed=0):
+    """ Random zones (x1, y1, x2, y2) over a 1920x1080 frame"""
+    random = np.random.RandomState(seed)
+    x1, y1 = random.randint(0, 1820, n_zones), random.randint(0, 980, n_zones)
+    return np.stack([x1, y1, x1 + random.randint(20, 100, n_zones), y1 + random.randint(20, 100, n_zones)], axis=1)
+
+
+class TestTagsPlacement(unittest.TestCase):
+
+    def test_best_sides(self):
+        zones = [(100, 100, 200, 300), (220, 100, 400, 300)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, [(70, 80), (70, 80)]),
+                         ['bottom_left', 'bottom_right'])
+        # Zones without tags are only obstacles
+        self.assertEqual(get_possible_positions(1280, 720, zones, [(70, 80), None]), ['bottom_left', None])
+
+    def test_memory(self):
+        memory = TagsLayoutMemory()
+        shapes = [(70, 80), (70, 80)]
+        zones = [(100, 100, 200, 300), (220, 100, 400, 300)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), ['bottom_left', 'bottom_right'])
+
+        # The first zone keeps its side although now bottom_right is free
+        zones = [(102, 100, 202, 300), (420, 100, 600, 300)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes), ['bottom_right', 'bottom_right'])
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), ['bottom_left', 'bottom_right'])
+
+        # But not when its side is not valid anymore
+        zones = [(30, 100, 130, 300), (420, 100, 600, 300)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), ['bottom_right', 'bottom_right'])
+
+    def test_memory_free_space(self):
+        memory = TagsLayoutMemory()
+        # The tags of the first zone don't fit anywhere (second zone is over all its sides)
+        zones = [(0, 0, 100, 100), (0, 0, 300, 300)]
+        shapes = [(70, 40), (70, 40)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), [None, 'bottom_right'])
+
+        # When the space is free, it is placed
+        zones = [(0, 0, 100, 100), (500, 0, 800, 300)]
+        self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), ['bottom_right', 'bottom_right'])
+
+    def test_memory_without_changes(self):
+        memory = TagsLayoutMemory()
+        # The tags of the first zone don't fit anywhere
+        zones = [(0, 0, 100, 100), (0, 0, 300, 300), (800, 300, 900, 400)]
+        shapes = [(70, 40)] * 3
+        expected = get_possible_positions(1280, 720, zones, shapes, memory=memory)
+        self.assertEqual(expected, [None, 'bottom_right', 'bottom_right'])
+
+        with mock.patch('cv2_tools.tags_constraint.solve_tags_layout', wraps=solve_tags_layout) as solve:
+            # Nothing changes
+            for _ in range(3):
+                self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), expected)
+            # A zone far from the zone without tags moves
+            zones[2] = (810, 300, 910, 400)
+            self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory), expected)
+            self.assertEqual(solve.call_count, 0)
+
+            # The zone that blocks it moves, so it is placed again
+            zones[1] = (500, 0, 800, 300)
+            self.assertEqual(get_possible_positions(1280, 720, zones, shapes, memory=memory)[0], 'bottom_right')
+            self.assertEqual(solve.call_count, 1)
+
+    def test_no_overlaps(self):
+        zones = random_zones(200)
+        shapes = [(70, 40)] * len(zones)
+
+        positions = get_possible_positions(1920, 1080, zones.tolist(), shapes)
+        candidates = get_candidate_positions(zones, np.array(shapes))
+        tags = [(i, candidates[i][SIDES.index(side)].tolist()) for i, side in enumerate(positions) if side]
+        self.assertTrue(tags)
+        for k, (i, tag) in enumerate(tags):
+            x1, y1, x2, y2 = tag
+            self.assertTrue(x1 >= 0 and y1 >= 0 and x2 <= 1920 and y2 <= 1080)
+            self.assertFalse(any(overlap(tag, zone) for j, zone in enumerate(zones.tolist()) if j != i))
+            self.assertFalse(any(overlap(tag, other) for _, other in tags[k+1:]))
+
+    def test_time_budget(self):
+        def best_time(zones, memory=None):
+            zones, shapes = zones.tolist(), [(70, 40)] * len(zones)
+            best = float('inf')
+            for _ in range(50):
+                start = time.perf_counter()
+                get_possible_positions(1920, 1080, zones, shapes, memory=memory)
+                best = min(best, time.perf_counter() - start)
+            return best
+
+        # 200 zones should be placed in less than 1 ms (check benchmarks/tags_layout.py). The
+        # limit is twice the budget, so a busy machine doesn't fail it, but a slower algorithm does
+        full_layout = best_time(random_zones(200))
+        self.assertLess(full_layout, 2e-3)
+        # A static scene with a TagsLayoutMemory is much faster
+        self.assertLess(best_time(random_zones(200), memory=TagsLayoutMemory()), full_layout / 2)
+
+
+class TestGridIndex(unittest.TestCase):
+
+    def test_same_as_brute_force(self):
+        random = np.random.RandomState(1)
+        for scale, dtype in ((1000, np.int64), (1, np.float64)):
+            rectangles = random.uniform(-0.1, 0.9, (300, 2)) * scale
+            rectangles = np.concatenate([rectangles, rectangles + random.uniform(0, 0.2, (300, 2)) * scale], axis=1).astype(dtype)
+            queries = rectangles[::-1][:100] + dtype(scale / 20)
+            expected = {(i, j) for i, query in enumerate(queries.tolist())
+                        for j, rectangle in enumerate(rectangles.tolist()) if overlap(query, rectangle)}
+
+            # With the grid and checking all the rectangles
+            for dense_rectangles in (0, len(rectangles)):
+                with mock.patch.object(GridIndex, 'dense_rectangles', dense_rectangles):
+                    index = GridIndex(rectangles)
+                self.assertEqual(index.dense, bool(dense_rectangles))
+                found = set(zip(*[ids.tolist() for ids in index.query_pairs(queries)]))
+                self.assertEqual(found, expected)
+
+                x, y = rectangles[7, :2].tolist()
+                self.assertIn(7, index.query_point(x, y))
+                ids = index.query(queries[0])
+                self.assertEqual(ids, sorted(j for i, j in expected if i == 0))
+
+    def test_empty(self):
+        for dense_rectangles in (0, 1):
+            with mock.patch.object(GridIndex, 'dense_rectangles', dense_rectangles):
+                self.assertEqual(GridIndex([]).query((0, 0, 10, 10)), [])
+                self.assertEqual(GridIndex([(0, 0, 10, 10)]).query((20, 20, 30, 30)), [])
+
+
+if __name__ == "__main__":
+    unittest.main()